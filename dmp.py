@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib
+import importlib.abc
+import importlib.util
+import os
+import sys
+
+# One entry point for the scripts, with a subcommand per script:
+# ./python3 dmp.py create -i 2021-04241 -n "Albert Einstein" -e aeinstein@example.com -t 439
+# The subcommands take the same options as the scripts (see ./python3 dmp.py <command> --help).
+# Startup is kept short for cron jobs and provisioning hooks: the script behind a subcommand
+# is imported with its heavy dependencies (requests, the API helpers, ...) loaded lazily, so
+# --help, argparse errors and shell completion never load the network stack. Measured with
+# ./python3 loadtest.py startup.
+# Bash completion: eval "$(./python3 dmp.py completion)"
+
+# command: (module, summary)
+COMMANDS = {
+    "create": ("swecris_to_dmponline", "Create DMPs in DMPonline from SweCRIS grants (single or batch)"),
+    "harvest": ("swecris_org_harvest", "Create DMPs for all SweCRIS projects of the organisation"),
+    "convert": ("swecris_jsonl_to_madmp", "Convert a JSONL dump of SweCRIS projects to maDMP offline"),
+    "templates": ("dmponline_templates", "Download all templates and update the template index"),
+    "download": ("dmponline2_file_v1", "Download plans through DMPonline API v1"),
+    "download-both": ("dmponline2_file", "Download plans through API v0 and v1 into one record"),
+    "download-v0": ("dmponline2_file_v0", "Download plans through DMPonline API v0"),
+    "archive": ("plan_archive", "Show the archived versions of downloaded plans"),
+    "sync": ("dmponline_sync", "Sync Downloaded_plans with the plans in DMPonline"),
+    "search": ("plan_search", "Full-text search in the downloaded plans"),
+    "export": ("dmponline_export", "Export the downloaded plans as CSV or Parquet tables"),
+    "reconcile": ("dmponline_reconcile", "Update the plans whose SweCRIS data changed"),
+}
+
+# Loaded lazily besides the modules of this repository
+LAZY_MODULES = {"requests", "urllib3", "jsonschema", "asyncio", "sqlite3"}
+
+BASH_COMPLETION = """_dmp_complete() {
+    local words
+    words=$("${COMP_WORDS[0]}" --complete "${COMP_WORDS[@]:1:COMP_CWORD-1}" 2>/dev/null)
+    COMPREPLY=($(compgen -W "$words" -- "${COMP_WORDS[COMP_CWORD]}"))
+}
+complete -o default -F _dmp_complete dmp.py ./dmp.py"""
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_lazy = []  # modules imported lazily, loaded for real by load_lazy_modules()
+
+
+class LazyFinder(importlib.abc.MetaPathFinder):
+    # Hands out modules that are only executed when one of their attributes is used
+
+    def __init__(self, exclude):
+        self.exclude = exclude
+
+    def lazy(self, name):
+        if name == self.exclude:
+            return False
+        if name in LAZY_MODULES:
+            return True
+        return "." not in name and os.path.exists(os.path.join(_here, name + ".py"))
+
+    def find_spec(self, name, path, target=None):
+        if not self.lazy(name):
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+                    return None
+                spec.loader = importlib.util.LazyLoader(spec.loader)
+                _lazy.append(name)
+                return spec
+        return None
+
+
+def import_command(name):
+    # The module behind a command, with its imports deferred
+    module_name = COMMANDS[name][0]
+    finder = LazyFinder(module_name)
+    sys.meta_path.insert(0, finder)
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        sys.meta_path.remove(finder)
+
+
+def load_lazy_modules():
+    # Loads the deferred modules now, in this thread: the scripts use them from worker threads
+    # and a lazy module must not be loaded by two threads at once
+    for name in _lazy:
+        module = sys.modules.get(name)
+        if module is not None:
+            getattr(module, "__name__")
+    del _lazy[:]
+
+
+def usage():
+    lines = ["usage: dmp.py <command> [options]", "", "commands:"]
+    for name, (module, summary) in COMMANDS.items():
+        lines.append("  " + name.ljust(12) + summary)
+    lines.append("  " + "completion".ljust(12) + "Print the bash completion script")
+    lines.append("")
+    lines.append("Use dmp.py <command> --help for the options of a command.")
+    return "\n".join(lines)
+
+
+def complete(words):
+    # Completion words for the command line typed so far (without dmp.py)
+    if not words:
+        return list(COMMANDS) + ["completion"]
+    if words[0] not in COMMANDS:
+        return []
+    parser = import_command(words[0]).build_parser()
+    return [option for action in parser._actions for option in action.option_strings]
+
+
+def main():
+    argv = sys.argv[1:]
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return
+    if argv[0] == "--complete":
+        print("\n".join(complete(argv[1:])))
+        return
+    if argv[0] == "completion":
+        print(BASH_COMPLETION)
+        return
+    name = argv[0]
+    if name not in COMMANDS:
+        sys.stderr.write(usage() + "\n\ndmp.py: error: unknown command " + name + "\n")
+        sys.exit(2)
+
+    # Metrics of each subcommand under its own name, see dmp_metrics.py
+    os.environ.setdefault("METRICS_JOB", COMMANDS[name][0])
+    module = import_command(name)
+    sys.argv[0] = "dmp.py " + name  # shown as prog in the usage of the command
+    # --help and errors found by argparse end here, before anything is loaded
+    module.build_parser().parse_args(argv[1:])
+    load_lazy_modules()
+    module.main(argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no file locking on Windows, the cache still works for a single process
+    fcntl = None
+
+import dmp_http
+import dmp_metrics
+
+# DMPonline access tokens, cached on disk so that every script run (and every
+# parallel process in a batch job) does not have to call "authenticate" again.
+# Tokens are keyed by API url + user and reused until shortly before they expire.
+# A 401 from DMPonline drops the cached token and authenticates once more.
+# Usage: token = dmp_auth.get_token()  or  dmp_auth.get(url, headers=...)
+#
+# Optional settings in .env:
+# TOKEN_CACHE   path of the cache file (default ~/.cache/dmp-scripts/tokens.json)
+
+EXPIRY_MARGIN = 60  # seconds, refresh a bit before DMPonline expires the token
+DEFAULT_EXPIRES_IN = 3600  # used if DMPonline does not say how long the token lives
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+_tokens = {}  # in-process copy of the cache
+_tokens_lock = threading.Lock()
+
+
+def cache_path():
+    path = os.getenv("TOKEN_CACHE")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "dmp-scripts", "tokens.json")
+
+
+@contextmanager
+def _locked(path):
+    # Exclusive lock shared by all processes using the same cache file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    lock_file = open(path + ".lock", "a")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _read_cache(path):
+    try:
+        with open(path, encoding="utf-8") as cf:
+            return json.load(cf)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(path, cache):
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as cf:
+        json.dump(cache, cf)
+    os.replace(tmp_path, path)
+
+
+def _valid(entry):
+    return entry is not None and entry["expires_at"] - EXPIRY_MARGIN > time.time()
+
+
+def authenticate(api_url):
+    # Authorize against DMPonline, returns (token, expires_at) or (None, None)
+    dmp_auth_url = api_url + "authenticate"
+    auth_headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+    auth_body = {
+        "grant_type": "authorization_code",
+        "email": os.getenv("DMPONLINE_USER"),
+        "code": os.getenv("DMPONLINE_AUTH_CODE"),
+    }
+    response = dmp_http.post(url=dmp_auth_url, json=auth_body, headers=auth_headers)
+    # Wrong credentials give None, throttling and server errors are raised
+    if dmp_http.classify(response.status_code) in ("throttled", "server"):
+        dmp_http.raise_for_status(response)
+    if dmp_http.classify(response.status_code) != "ok":
+        return None, None
+    try:
+        authdata = json.loads(response.text)
+    except ValueError:
+        return None, None
+    if "access_token" not in authdata:
+        return None, None
+    created_at = authdata.get("created_at") or time.time()
+    expires_in = authdata.get("expires_in") or DEFAULT_EXPIRES_IN
+    return authdata["access_token"], created_at + expires_in
+
+
+def get_token(api_url=None, stale=None):
+    # Returns a valid bearer token, or None if authentication failed.
+    # Pass the token that was just rejected as stale to force a new one.
+    api_url = api_url or os.getenv("DMPONLINE_API_URL")
+    key = api_url + "|" + (os.getenv("DMPONLINE_USER") or "")
+
+    with _tokens_lock:
+        entry = _tokens.get(key)
+        if _valid(entry) and entry["access_token"] != stale:
+            return entry["access_token"]
+
+        path = cache_path()
+        with _locked(path):
+            cache = _read_cache(path)
+            entry = cache.get(key)
+            # Another process may already have replaced the stale token
+            if _valid(entry) and entry["access_token"] != stale:
+                dmp_metrics.cache("token", "hit")
+            else:
+                dmp_metrics.cache("token", "miss")
+                token, expires_at = authenticate(api_url)
+                if token is None:
+                    return None
+                entry = {"access_token": token, "expires_at": expires_at}
+                cache[key] = entry
+                _write_cache(path, cache)
+        _tokens[key] = entry
+        return entry["access_token"]
+
+
+def request(method, url, api_url=None, **kwargs):
+    # Bearer authorized request, re-authenticates once if the token is rejected
+    headers = dict(kwargs.pop("headers", None) or {})
+    token = get_token(api_url)
+    if token is None:
+        raise AuthenticationError("Authentication request failed!")
+    headers["Authorization"] = "Bearer " + token
+    response = dmp_http.request(method, url, headers=headers, **kwargs)
+    if response.status_code == 401:
+        token = get_token(api_url, stale=token)
+        if token is None:
+            return response
+        headers["Authorization"] = "Bearer " + token
+        response.close()  # gives the connection back to the pool, also for a streamed response
+        response = dmp_http.request(method, url, headers=headers, **kwargs)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
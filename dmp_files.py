@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+# Where the scripts keep the downloaded plans and the files that go with them, and how the
+# plan id is read from a plan, and the sqlite connections of the ledger, the SweCRIS cache and
+# the plan archive. Imports nothing but the standard library, so the scripts can use these when
+# they are imported (parser defaults, worker processes) without loading requests, see dmp.py.
+
+DOWNLOAD_DIR = "Downloaded_plans"
+SYNC_STATE_FILE = os.path.join(DOWNLOAD_DIR, ".sync_state.json")
+SEARCH_INDEX_FILE = os.path.join(DOWNLOAD_DIR, ".search_index.sqlite")
+
+_local = threading.local()  # one sqlite connection per thread and file
+
+
+def plan_id_of(item):
+    # The plan id is the last part of the dmp_id url, e.g. https://dmp.kth.se/api/v1/plans/123456
+    identifier = item["dmp"]["dmp_id"]["identifier"]
+    return identifier.rstrip("/").rsplit("/", 1)[-1]
+
+
+def sqlite_connection(path, schema_sql, setup=None):
+    # The calling thread's connection to the sqlite file at path, made on first use: in WAL mode,
+    # so readers and one writer work at the same time, with the tables of schema_sql created and
+    # setup(db) called if given
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    db = connections.get(path)
+    if db is None:
+        import sqlite3
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            pass  # another connection is switching to WAL right now, the mode is kept in the file
+        db.executescript(schema_sql)
+        if setup is not None:
+            setup(db)
+        connections[path] = db
+    return db
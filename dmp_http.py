@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import dmp_metrics
+
+# Shared HTTP client used by all scripts talking to DMPonline and SweCRIS.
+# One pooled requests.Session is kept per host, so repeated calls reuse the
+# same keep-alive connections instead of doing a new TCP+TLS handshake each time.
+# Every host also gets a rate limiter (token bucket) that is shared by all threads.
+# When the server answers 429 or 503 the limiter halves its rate and the number of
+# requests allowed in flight, waits for Retry-After, and slowly speeds up again
+# while requests succeed, so bulk runs stay just below what the server accepts.
+# Refused requests are retried with jittered exponential backoff.
+# Every request is logged and counted through dmp_metrics.py.
+# Usage: dmp_http.get(url, headers=...) / dmp_http.post(url, json=..., headers=...)
+#        dmp_http.raise_for_status(response) raises an error class matching the status
+#
+# Optional settings in .env:
+# HTTP_POOL_SIZE  connections kept open per host, also the most requests in flight (default 10)
+# HTTP_TIMEOUT    seconds before a connect/read gives up (default 30)
+# HTTP_RETRIES    retries on connection errors and 429/502/503/504 responses (default 3)
+# HTTP_RATE       most requests per second per host (default 10)
+
+THROTTLE_STATUS = (429, 503)
+RETRY_STATUS = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+BACKOFF_BASE = 0.5  # seconds, doubled for every retry
+BACKOFF_MAX = 60
+RETRY_AFTER_MAX = 600
+MIN_RATE = 0.2  # requests per second the limiter never goes below
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_limiters = {}
+_observers = []
+
+
+class HTTPStatusError(requests.exceptions.HTTPError):
+    # An error answer from the server, the subclasses tell what kind
+    kind = "error"
+
+
+class ThrottledError(HTTPStatusError):
+    kind = "throttled"
+
+
+class ServerError(HTTPStatusError):
+    kind = "server"
+
+
+class ClientError(HTTPStatusError):
+    kind = "client"
+
+
+class UnauthorizedError(ClientError):
+    kind = "unauthorized"
+
+
+class NotFoundError(ClientError):
+    kind = "not_found"
+
+
+_ERRORS = {
+    "throttled": ThrottledError,
+    "server": ServerError,
+    "client": ClientError,
+    "unauthorized": UnauthorizedError,
+    "not_found": NotFoundError,
+}
+
+
+def _setting(name, default, cast):
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return cast(value)
+
+
+def pool_size():
+    return _setting("HTTP_POOL_SIZE", 10, int)
+
+
+def timeout():
+    return _setting("HTTP_TIMEOUT", 30.0, float)
+
+
+def retries():
+    return _setting("HTTP_RETRIES", 3, int)
+
+
+def rate():
+    return _setting("HTTP_RATE", 10.0, float)
+
+
+def classify(status_code):
+    # ok, redirect, throttled, unauthorized, not_found, client or server
+    if status_code < 300:
+        return "ok"
+    if status_code < 400:
+        return "redirect"
+    if status_code in THROTTLE_STATUS:
+        return "throttled"
+    if status_code in (401, 403):
+        return "unauthorized"
+    if status_code in (404, 410):
+        return "not_found"
+    if status_code < 500:
+        return "client"
+    return "server"
+
+
+def raise_for_status(response):
+    # Like response.raise_for_status(), with the error class chosen by status code
+    kind = classify(response.status_code)
+    if kind in _ERRORS:
+        raise _ERRORS[kind](str(response.status_code) + " " + kind + " error for url: " + response.url,
+                            response=response)
+    return response
+
+
+class RateLimiter:
+    # Token bucket plus a limit on requests in flight, both adjusted to the answers:
+    # halved on 429/503 (once per burst of throttled answers), then raised again step by
+    # step, once per second's worth of successful requests.
+
+    def __init__(self, max_rate, max_active):
+        self.max_rate = max(max_rate, MIN_RATE)
+        self.rate = self.max_rate
+        self.max_active = max(max_active, 1)
+        self.limit = self.max_active
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.active = 0
+        self.blocked_until = 0.0
+        self.calm_until = 0.0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0 and self.active < self.limit:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.active += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.condition.wait(wait if wait > 0 else None)
+
+    def release(self, throttled=False, retry_after=None):
+        with self.condition:
+            self.active -= 1
+            now = time.monotonic()
+            if throttled:
+                self.successes = 0
+                # Requests already in flight may come back throttled too, count that as one signal
+                if now >= self.calm_until:
+                    self.rate = max(self.rate / 2, MIN_RATE)
+                    self.limit = max(self.limit // 2, 1)
+                    self.tokens = min(self.tokens, 0.0)
+                    self.calm_until = now + self.limit / self.rate
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+            else:
+                self.successes += 1
+                recovering = self.rate < self.max_rate or self.limit < self.max_active
+                if recovering and self.successes >= max(self.rate, self.limit):
+                    self.successes = 0
+                    self.rate = min(self.rate + self.max_rate / 10, self.max_rate)
+                    self.limit = min(self.limit + 1, self.max_active)
+            self.condition.notify_all()
+
+
+def add_observer(callback):
+    # callback(method, url, status_code, seconds) is called after every attempt,
+    # status_code is None if no answer came back
+    _observers.append(callback)
+
+
+def remove_observer(callback):
+    _observers.remove(callback)
+
+
+def _observe(method, url, response, started, attempt):
+    seconds = time.monotonic() - started
+    status_code = None if response is None else response.status_code
+    size = None
+    if response is not None and response.headers.get("Content-Length", "").isdigit():
+        size = int(response.headers["Content-Length"])
+    dmp_metrics.request(method, url, status_code, seconds, attempt, size)
+    for callback in list(_observers):
+        callback(method, url, status_code, seconds)
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return parts.scheme + "://" + parts.netloc
+
+
+def get_limiter(url):
+    key = _host(url)
+    with _sessions_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(rate(), pool_size())
+            _limiters[key] = limiter
+        return limiter
+
+
+def retry_after(response):
+    # Seconds from a Retry-After header (a number or an HTTP date), None if missing
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+
+def backoff(attempt):
+    # Full jitter: a random wait up to BACKOFF_BASE * 2^attempt
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retryable(method, status_code):
+    # A 429 was refused before it was handled, so even a POST can be sent again
+    if status_code == 429:
+        return True
+    return status_code in RETRY_STATUS and method.upper() in IDEMPOTENT_METHODS
+
+
+def _new_session():
+    # urllib3 only retries connection errors here, error answers are retried in request()
+    retry = Retry(
+        total=retries(),
+        backoff_factor=BACKOFF_BASE,
+        status=0,
+        raise_on_status=False,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size(), max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    # One session per scheme + host, shared between threads
+    key = _host(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _new_session()
+            _sessions[key] = session
+        return session
+
+
+def request(method, url, **kwargs):
+    # Rate limited request, retried on 429 (and 502/503/504 for idempotent methods).
+    # The last answer is returned as is, use raise_for_status() to turn it into an error.
+    kwargs.setdefault("timeout", timeout())
+    session = get_session(url)
+    limiter = get_limiter(url)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except BaseException:
+            limiter.release()
+            _observe(method, url, None, started, attempt)
+            raise
+        _observe(method, url, response, started, attempt)
+        throttled = response.status_code in THROTTLE_STATUS
+        wait = retry_after(response) if throttled else None
+        limiter.release(throttled, wait)
+        if attempt >= retries() or not _retryable(method, response.status_code):
+            return response
+        response.close()
+        time.sleep(backoff(attempt) if wait is None else wait)
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+
+def close():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _limiters.clear()
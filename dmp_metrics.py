@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Structured logs and metrics for the scripts, both off unless set in .env.
+# REQUEST_LOG gets one JSON line per HTTP request (host, endpoint, status, bytes, latency,
+# retry) and per cache lookup (hit/miss), written by dmp_http.py and the caches.
+# METRICS_DIR gets a Prometheus textfile per script (dmp_<job>.prom) when the script ends,
+# with request counts and latencies per host plus the counters of the run (grants
+# processed, plans created/downloaded, failures), for node_exporter's textfile collector.
+# Usage: dmp_metrics.inc("grants", status="created")
+#
+# Optional settings in .env:
+# REQUEST_LOG   JSON-lines file to append to (default: no log)
+# METRICS_DIR   folder for the Prometheus textfiles (default: no metrics)
+# METRICS_JOB   name of the job, used as the script label and in the file name (default: name
+#               of the script, dmp.py sets it to the script behind the subcommand)
+
+PREFIX = "dmp_"
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+HELP = {
+    "http_requests": "HTTP requests sent, by host, method and status code",
+    "http_retries": "HTTP requests that were retries of a refused request",
+    "http_request_duration_seconds": "Time until the answer (headers) arrived",
+    "cache_lookups": "Cache lookups, by cache and result",
+    "grants": "SweCRIS grants processed, by result",
+    "plans_downloaded": "Plans downloaded from DMPonline, by result",
+    "templates": "Templates harvested from DMPonline",
+    "sync_plans": "Plans seen by dmponline_sync.py, by result",
+    "reconcile_plans": "Plans checked and updated by dmponline_reconcile.py, by result",
+    "stage_duration_seconds": "Time a pipeline stage worked on a unit, by stage (see run_pipeline.py)",
+    "stage_blocked_seconds": "Time pipeline stages waited for room in the next stage's queue, by stage",
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [count per bucket..., sum, count]
+_started = time.time()
+_log_file = None
+
+
+def job():
+    # The name the metrics of this run are kept under, one textfile per job
+    return os.getenv("METRICS_JOB") or os.path.splitext(os.path.basename(sys.argv[0] or "dmp"))[0] or "dmp"
+
+
+def endpoint(path):
+    # URL path with the ids replaced, so requests can be grouped, e.g. /api/v1/plans/{id}
+    parts = []
+    for part in path.strip("/").split("/"):
+        parts.append("{id}" if any(c.isdigit() for c in part) and part not in ("v0", "v1") else part)
+    return "/" + "/".join(parts)
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def log(event, **fields):
+    # Appends one JSON line to REQUEST_LOG, if set
+    global _log_file
+    path = os.getenv("REQUEST_LOG")
+    if not path:
+        return
+    line = json.dumps(dict({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "job": job(), "event": event}, **fields))
+    with _lock:
+        if _log_file is None or _log_file.name != path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            _log_file = open(path, "a", encoding="utf-8", buffering=1)
+        _log_file.write(line + "\n")
+
+
+def request(method, url, status_code, seconds, attempt=0, size=None):
+    # One HTTP request, called by dmp_http.py. status_code is None if no answer came back.
+    host = urlsplit(url).netloc
+    log("http", method=method, host=host, endpoint=endpoint(urlsplit(url).path), status=status_code,
+        bytes=size, seconds=round(seconds, 4), retry=attempt)
+    inc("http_requests", host=host, method=method, status=status_code or "error")
+    if attempt:
+        inc("http_retries", host=host)
+    observe("http_request_duration_seconds", seconds, host=host)
+
+
+def cache(name, result, key=None):
+    # One cache lookup: result is hit, miss or revalidated
+    log("cache", cache=name, result=result, key=key)
+    inc("cache_lookups", cache=name, result=result)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(name + '="' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                          for name, value in pairs) + "}"
+
+
+def render():
+    # All metrics in the Prometheus text format
+    lines = []
+    # Not "job": Prometheus sets that label itself when it scrapes node_exporter
+    job_label = (("script", job()),)
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+    typed = set()
+    for (name, labels), value in counters:
+        metric = PREFIX + name + "_total"
+        if metric not in typed:
+            typed.add(metric)
+            lines.append("# HELP " + metric + " " + HELP.get(name, name))
+            lines.append("# TYPE " + metric + " counter")
+        lines.append(metric + _format_labels(job_label + labels) + " " + str(value))
+    for (name, labels), histogram in histograms:
+        metric = PREFIX + name
+        if metric not in typed:
+            typed.add(metric)
+            lines.append("# HELP " + metric + " " + HELP.get(name, name))
+            lines.append("# TYPE " + metric + " histogram")
+        for bound, count in zip(BUCKETS, histogram):
+            lines.append(metric + "_bucket" + _format_labels(job_label + labels, (("le", str(bound)),)) + " " + str(count))
+        lines.append(metric + "_bucket" + _format_labels(job_label + labels, (("le", "+Inf"),)) + " " + str(histogram[-1]))
+        lines.append(metric + "_sum" + _format_labels(job_label + labels) + " " + "%.6f" % histogram[-2])
+        lines.append(metric + "_count" + _format_labels(job_label + labels) + " " + str(histogram[-1]))
+    now = time.time()
+    lines.append("# HELP " + PREFIX + "run_duration_seconds How long the last run took")
+    lines.append("# TYPE " + PREFIX + "run_duration_seconds gauge")
+    lines.append(PREFIX + "run_duration_seconds" + _format_labels(job_label) + " " + "%.3f" % (now - _started))
+    lines.append("# HELP " + PREFIX + "run_finished_timestamp_seconds When the last run ended")
+    lines.append("# TYPE " + PREFIX + "run_finished_timestamp_seconds gauge")
+    lines.append(PREFIX + "run_finished_timestamp_seconds" + _format_labels(job_label) + " " + "%.3f" % now)
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(directory=None):
+    # Writes METRICS_DIR/dmp_<job>.prom, atomically so the collector never reads half a file
+    directory = directory or os.getenv("METRICS_DIR")
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PREFIX + job() + ".prom")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(render())
+    os.replace(tmp_path, path)
+    return path
+
+
+atexit.register(write_textfile)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from dotenv import load_dotenv
+import os
+import shutil
+
+import dmp_auth
+import dmponline_plans
+import run_journal
+
+# Simple script for dowloading DMP:s from DMP Online through both APIs in one go: the full
+# answers from API V0 and the RDA metadata from API V1. The two requests for a plan are sent
+# at the same time over the shared connection pool and the answers are merged into one record,
+# {"plan_id": ..., "v1": [...], "v0": [...]}, stored as Downloaded_plans/<id>_API_V0V1_dmp.json.
+# Example: ./python3 dmponline2_file.py -i 135516
+# Bulk example: ./python3 dmponline2_file.py -i 135500-135599 135700 --concurrency 16 --yes
+#
+# / matves29@kth.se
+#
+
+# Settings
+load_dotenv()
+dmpurl = os.getenv("DMPONLINE_API_URL")
+dmpurl_v0 = os.getenv("DMPONLINE_API_URL_V0")
+logfile = os.getenv("LOGFILE")
+
+yes = {"yes", "y", "ye", "j", "ja", ""}
+no = {"no", "n", "nej"}
+
+
+def print_file(path):
+    with open(path, encoding="utf-8") as plan_file:
+        shutil.copyfileobj(plan_file, sys.stdout)
+    print("")
+    print("#######################")
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(
+        description="Script for downloading one or more DMPs from the DMPonline API V0 and V1 into one record.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-i", "--planid", nargs="*", default=[],
+                        help="DMP online ID(s), also ranges (135500-135599) and comma separated lists")
+    parser.add_argument("--file", default="", help="File with one DMP online ID per line")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of plans downloaded at the same time "
+                                                                       "(each with two requests)")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    parser.add_argument("--resume", action="store_true", help="Skip the plans an interrupted bulk download "
+                                                             "already saved (see Journals/)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    planids = dmponline_plans.parse_plan_ids(args.planid, args.file)
+    if not planids:
+        parser.error("no plan ids given, use -i/--planid or --file")
+
+    # Go ahead and download from DMPOnline from here...
+    if len(planids) == 1:
+        print("Should I download a plan through the v0 and v1 API and save it as a JSON? (y/n)")
+    else:
+        print("Should I download " + str(len(planids)) + " plans through the v0 and v1 API and save them as JSON? (y/n)")
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+        # Authorize once for v1, all downloads share the (cached) token, see dmp_auth.py.
+        # v0 takes the API key from .env with every request.
+        try:
+            dmp_auth_bearer = dmp_auth.get_token()
+            if dmp_auth_bearer is None:
+                print("Authentication request failed! Exiting.")
+                exit()
+
+            print("Authorized! Access token: " + dmp_auth_bearer)
+
+        except requests.exceptions.HTTPError as e:
+            print("Failed! authdata: " + str(e))
+            exit()
+
+        # Journal the download, so an interrupted run can go on with --resume
+        journal = run_journal.Journal("download_v0v1_" + run_journal.job_key(planids), resume=args.resume)
+        if args.resume:
+            print("Resuming: " + journal.summary())
+            planids = journal.remaining(planids)
+        try:
+            failed = dmponline_plans.download_plans(planids, dmponline_plans.download_plan_combined,
+                                                    args.concurrency, journal=journal)
+            journal.close(finished=True)
+        finally:
+            journal.close()
+        if args.verbose and len(planids) == 1 and not failed:
+            print_file(dmponline_plans.plan_path(planids[0], "V0V1"))
+        print("Done. Downloaded: " + str(len(planids) - len(failed)) + ", failed: " + str(len(failed)))
+
+    elif choice in no:
+        print("OK. Will exit then.")
+        exit()
+
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
+
+    exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import requests
-import json
 import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from dotenv import load_dotenv
-from datetime import datetime
 import os
-import uuid
+import shutil
+
+import dmponline_plans
+import run_journal
 
 # Simple script for dowloading DMP:s from DMP Online using the API v.0 (which does not comply with the RDA json scheme).
-# Example: ./python3 dmponline2file.py -i 135516
+# Example: ./python3 dmponline2_file_v0.py -i 135516
+# Bulk example: ./python3 dmponline2_file_v0.py -i 135500-135599 135700 --concurrency 16 --yes
 #
 # / matves29@kth.se
 #
@@ -25,74 +27,90 @@ dmp_id_prefix = os.getenv("DMP_ID_PREFIX")
 logfile = os.getenv("LOGFILE")
 dmpAPIkey = os.getenv("DMPONLINE_AUTH_CODE")
 
-# Input params
-parser = ArgumentParser(
-    description="Script for downloading a specific DMP from the DMPonline API.",
-    formatter_class=ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
-parser.add_argument("-i", "--planid", default="", help="DMP online ID", required=True)
-args = parser.parse_args()
-
-dmpid = args.planid
-
-
-# Go ahead and create dowload from DMPOnline from here...
-print(
-    "Should I download a plan through the v0 API and save it as a JSON? (y/n)"
-)
 yes = {"yes", "y", "ye", "j", "ja", ""}
 no = {"no", "n", "nej"}
-choice = input().lower()
-if choice in yes:
-    # Get the plan
-    
-    plan_headers = {
-    'Authorization': 'Token token='+ dmpAPIkey,
-    'Content-Type': 'application/json',
-    }
 
-    plan_params = {
-    'plan': dmpid,
-    }
-    dmp_plan_url = os.getenv("DMPONLINE_API_URL_V0") + "plans?plan="+dmpid
-
-    
 
+def download_single(dmpid, verbose=False):
+    # Get the plan
+    dmp_plan_url = os.getenv("DMPONLINE_API_URL_V0") + "plans?plan=" + dmpid
     try:
-        plandata = requests.get(url=dmp_plan_url, headers=plan_headers).text
-        
-        if "Internal server error" in plandata:
-            print("Authentication request failed! Exiting.")
-            exit()
-        else:    
-            print("Success! Retireved the following:")
-            print(plandata)
-            print("#######################")
-            print("Plan retrieved from: " + dmp_plan_url)
-
-        
-        if not os.path.exists('Downloaded_plans'):
-            os.makedirs('Downloaded_plans') 
-        filename = dmpid + "_API_V0_dmp.json"
-        path = os.path.join('Downloaded_plans', filename) 
- 
-        out_file = open(path, "w") 
-        out_file.write(plandata) 
-        out_file.close()
-        
+        # Streamed straight to disk, see dmponline_plans.py
+        path = dmponline_plans.download_plan_v0(dmpid)
+        print("Success! Plan retrieved from: " + dmp_plan_url)
+        if verbose:
+            print_file(path)
         print("Stored as: " + path)
 
     except requests.exceptions.HTTPError as e:
-        print("Failed! plandata: " + plandata)
+        print("Failed! plandata: " + str(e))
+        exit()
+
+
+def print_file(path):
+    with open(path, encoding="utf-8") as plan_file:
+        shutil.copyfileobj(plan_file, sys.stdout)
+    print("")
+    print("#######################")
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(
+        description="Script for downloading one or more DMPs from the DMPonline API.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-i", "--planid", nargs="*", default=[],
+                        help="DMP online ID(s), also ranges (135500-135599) and comma separated lists")
+    parser.add_argument("--file", default="", help="File with one DMP online ID per line")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of plans downloaded at the same time")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    parser.add_argument("--resume", action="store_true", help="Skip the plans an interrupted bulk download "
+                                                             "already saved (see Journals/)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    planids = dmponline_plans.parse_plan_ids(args.planid, args.file)
+    if not planids:
+        parser.error("no plan ids given, use -i/--planid or --file")
+
+    # Go ahead and create dowload from DMPOnline from here...
+    if len(planids) == 1:
+        print("Should I download a plan through the v0 API and save it as a JSON? (y/n)")
+    else:
+        print("Should I download " + str(len(planids)) + " plans through the v0 API and save them as JSON? (y/n)")
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+        if len(planids) == 1:
+            download_single(planids[0], args.verbose)
+        else:
+            # Journal the bulk download, so an interrupted run can go on with --resume
+            journal = run_journal.Journal("download_v0_" + run_journal.job_key(planids), resume=args.resume)
+            if args.resume:
+                print("Resuming: " + journal.summary())
+                planids = journal.remaining(planids)
+            try:
+                failed = dmponline_plans.download_plans(planids, dmponline_plans.download_plan_v0,
+                                                        args.concurrency, journal=journal)
+                journal.close(finished=True)
+            finally:
+                journal.close()
+            print("Done. Downloaded: " + str(len(planids) - len(failed)) + ", failed: " + str(len(failed)))
+
+    elif choice in no:
+        print("OK. Will exit then.")
         exit()
-         
 
-elif choice in no:
-    print("OK. Will exit then.")
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
+
     exit()
 
-else:
-    sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
 
-exit()
+if __name__ == "__main__":
+    main()
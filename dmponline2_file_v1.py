@@ -2,16 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import requests
-import json
 import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from dotenv import load_dotenv
-from datetime import datetime
 import os
-import uuid
+import shutil
+
+import dmp_auth
+import dmponline_plans
+import run_journal
 
 # Simple script for dowloading DMP:s from DMP Online using the API V1 (which does comply with the RDA json scheme).
-# Example: ./python3 dmponline2file.py -i 135516
+# Example: ./python3 dmponline2_file_v1.py -i 135516
+# Bulk example: ./python3 dmponline2_file_v1.py -i 135500-135599 135700 --concurrency 16 --yes
 #
 # / matves29@kth.se
 #
@@ -24,116 +27,109 @@ dmppw = os.getenv("DMPONLINE_PW")
 dmp_id_prefix = os.getenv("DMP_ID_PREFIX")
 logfile = os.getenv("LOGFILE")
 
-# Input params
-parser = ArgumentParser(
-    description="est script for downloading a specific DMP from the DMPonline API V1.",
-    formatter_class=ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
-parser.add_argument("-i", "--planid", default="", help="DMP online ID", required=False)
-args = parser.parse_args()
-
-dmpid = args.planid
-
-# Go ahead and create DMP in DMPOnline from here...
-print(
-    "Should I download a plan through the v1 API and save it as a JSON? (y/n)"
-)
 yes = {"yes", "y", "ye", "j", "ja", ""}
 no = {"no", "n", "nej"}
-choice = input().lower()
-if choice in yes:
-    # Authorize
-    dmp_auth_bearer = ""
-    dmp_auth_url = os.getenv("DMPONLINE_API_URL") + "authenticate"
-    auth_headers = {"Accept": "application/json", "Content-Type": "application/json"}
-    auth_body = {
-        "grant_type": "authorization_code",
-        "email": os.getenv("DMPONLINE_USER"),
-        "code": os.getenv("DMPONLINE_AUTH_CODE"),
-    }
-    try:
-        authdata = requests.post(
-            url=dmp_auth_url, json=auth_body, headers=auth_headers
-        ).text
-
-        print(authdata)
-        
-        if "Internal server error" in authdata:
-            print("Authentication request failed! Exiting.")
-            exit()
 
-        authdata = json.loads(authdata)
-        
-        print(authdata)
-        
-        dmp_auth_bearer = authdata["access_token"]
 
-        print("Authorized! Access token: " + dmp_auth_bearer)
-
-    except requests.exceptions.HTTPError as e:
-        print("Failed! authdata: " + authdata)
-        exit()
-
-   
-
-    # Request a specific plan using the authentication token 
+def download_single(dmpid, verbose=False):
+    # Request a specific plan using the authentication token
     print("")
     print(
         "###############################################################################################################"
     )
     print("Now I will try to download a specific plan from dmp.kth.se")
     print("")
+    dmp_plan_url = os.getenv("DMPONLINE_API_URL") + "plans/" + dmpid
     try:
-        dmp_plan_url = os.getenv("DMPONLINE_API_URL") + "plans/" + dmpid
-        
-        plan_headers = {
-            "Accept": "application/json",
-            "Authorization": "Bearer " + dmp_auth_bearer,
-        }
-
-        plandata = requests.get(url=dmp_plan_url, headers=plan_headers).text
-        
-        if "Internal server error" in plandata:
-            print("Authentication request failed! Exiting.")
-            exit()
-        else:    
-            print("Success! Retireved the following:")
-            print(plandata)
-            print("#######################")
-            print("Plan retrieved from: " + dmp_plan_url)
+        # Streamed straight to disk, see dmponline_plans.py
+        path = dmponline_plans.download_plan_v1(dmpid)
+        print("Success! Plan retrieved from: " + dmp_plan_url)
+        if verbose:
+            print_file(path)
+        print("Stored as: " + path)
 
-        
+    except (requests.exceptions.HTTPError, ValueError) as e:
+        print("Failed! plandata: " + str(e))
+        exit()
 
-        if not os.path.exists('Downloaded_plans'):
-            os.makedirs('Downloaded_plans') 
-        filename = dmpid + "_API_V1_dmp.json"
-        path = os.path.join('Downloaded_plans', filename) 
 
-        plandata = json.loads(plandata)
-        plan_items = plandata['items']
-                      
-        jd=json.dumps(plan_items, indent =2)
+def print_file(path):
+    with open(path, encoding="utf-8") as plan_file:
+        shutil.copyfileobj(plan_file, sys.stdout)
+    print("")
+    print("#######################")
 
-        out_file = open(path, "w") 
-        out_file.write(jd) 
-        out_file.close()
 
-        print("Stored as: " + path)
-            
+def build_parser():
+    # Input params
+    parser = ArgumentParser(
+        description="Script for downloading one or more DMPs from the DMPonline API V1.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-i", "--planid", nargs="*", default=[],
+                        help="DMP online ID(s), also ranges (135500-135599) and comma separated lists")
+    parser.add_argument("--file", default="", help="File with one DMP online ID per line")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of plans downloaded at the same time")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    parser.add_argument("--resume", action="store_true", help="Skip the plans an interrupted bulk download "
+                                                             "already saved (see Journals/)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    planids = dmponline_plans.parse_plan_ids(args.planid, args.file)
+    if not planids:
+        parser.error("no plan ids given, use -i/--planid or --file")
+
+    # Go ahead and download from DMPOnline from here...
+    if len(planids) == 1:
+        print("Should I download a plan through the v1 API and save it as a JSON? (y/n)")
+    else:
+        print("Should I download " + str(len(planids)) + " plans through the v1 API and save them as JSON? (y/n)")
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+        # Authorize once, all downloads share the (cached) token, see dmp_auth.py
+        try:
+            dmp_auth_bearer = dmp_auth.get_token()
+            if dmp_auth_bearer is None:
+                print("Authentication request failed! Exiting.")
+                exit()
+
+            print("Authorized! Access token: " + dmp_auth_bearer)
+
+        except requests.exceptions.HTTPError as e:
+            print("Failed! authdata: " + str(e))
+            exit()
 
-    except requests.exceptions.HTTPError as e:
-        print("Failed! plandata: " + plandata)
+        if len(planids) == 1:
+            download_single(planids[0], args.verbose)
+        else:
+            # Journal the bulk download, so an interrupted run can go on with --resume
+            journal = run_journal.Journal("download_v1_" + run_journal.job_key(planids), resume=args.resume)
+            if args.resume:
+                print("Resuming: " + journal.summary())
+                planids = journal.remaining(planids)
+            try:
+                failed = dmponline_plans.download_plans(planids, dmponline_plans.download_plan_v1,
+                                                        args.concurrency, journal=journal)
+                journal.close(finished=True)
+            finally:
+                journal.close()
+            print("Done. Downloaded: " + str(len(planids) - len(failed)) + ", failed: " + str(len(failed)))
+
+    elif choice in no:
+        print("OK. Will exit then.")
         exit()
 
-   
-elif choice in no:
-    print("OK. Will exit then.")
-    exit()
-
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
 
-else:
-    sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
+    exit()
 
 
-exit()
+if __name__ == "__main__":
+    main()
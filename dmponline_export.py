@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from multiprocessing import Pool
+
+import dmp_files
+
+# Simple script that exports the plans in Downloaded_plans as flat tables for analysis:
+# plans, projects, funding, contributors and datasets from the RDA items (API V1 files), and
+# plans and answers from the API V0 files (both from the combined V0V1 files). One row per
+# plan, project, contributor, ... with the plan id in every table, written as CSV or Parquet
+# (needs pyarrow) to the folder Exports.
+# The rows are kept in Exports/export.sqlite between runs and only files that are new or
+# changed (size or modification time) since the last export are parsed again, spread over
+# a pool of processes. Removed files drop out of the tables.
+# Example: ./python3 dmponline_export.py --format parquet -p 4
+#
+# // matves29@kth.se
+
+EXPORT_DIR = "Exports"
+STATE_DB = "export.sqlite"
+FILE_PATTERN = re.compile(r"^(.+)_API_(V[01]|V0V1)_dmp\.json$")
+CHUNK_SIZE = 16  # files handed to a worker process at a time
+
+# table: columns, the SQLite tables also have the source file of every row
+TABLES = {
+    "plans": ["plan_id", "api", "title", "description", "language", "created", "modified",
+              "ethical_issues_exist", "contact_name", "contact_mbox", "template_id", "template_title",
+              "dmp_id", "grant_number"],
+    "projects": ["plan_id", "project", "title", "description", "start", "end"],
+    "funding": ["plan_id", "project", "funder_name", "funder_id", "grant_id", "funding_status"],
+    "contributors": ["plan_id", "name", "mbox", "role", "affiliation", "contributor_id"],
+    "datasets": ["plan_id", "dataset", "type", "title", "description", "personal_data", "sensitive_data",
+                 "dataset_id"],
+    "answers": ["plan_id", "phase", "section", "question", "question_text", "answer"],
+}
+
+
+def _text(value):
+    # Cell value: strings as is, lists joined with "; ", objects as JSON
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "; ".join(str(_text(part)) for part in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _identifier(value):
+    # The identifier of an {"identifier": ..., "type": ...} object
+    if isinstance(value, dict):
+        return value.get("identifier")
+    return value
+
+
+def _template(dmp):
+    for extension in dmp.get("extension") or []:
+        template = (extension.get("dmproadmap") or {}).get("template")
+        if template:
+            return template
+    return {}
+
+
+def flatten_v1(planid, items, rows):
+    # Rows of the RDA items of an API V1 file
+    for item in items:
+        dmp = item.get("dmp") or {}
+        if "dmp_id" in dmp:
+            planid = dmp_files.plan_id_of(item)
+        contact = dmp.get("contact") or {}
+        template = _template(dmp)
+        rows["plans"].append([planid, "v1", dmp.get("title"), dmp.get("description"), dmp.get("language"),
+                              dmp.get("created"), dmp.get("modified"), dmp.get("ethical_issues_exist"),
+                              contact.get("name"), contact.get("mbox"), template.get("id"), template.get("title"),
+                              _identifier(dmp.get("dmp_id")), None])
+        for number, project in enumerate(dmp.get("project") or [], 1):
+            rows["projects"].append([planid, number, project.get("title"), project.get("description"),
+                                     project.get("start"), project.get("end")])
+            for funding in project.get("funding") or []:
+                rows["funding"].append([planid, number, funding.get("name"), _identifier(funding.get("funder_id")),
+                                        _identifier(funding.get("grant_id")), funding.get("funding_status")])
+        for contributor in dmp.get("contributor") or []:
+            rows["contributors"].append([planid, contributor.get("name"), contributor.get("mbox"),
+                                         contributor.get("role"), (contributor.get("affiliation") or {}).get("name"),
+                                         _identifier(contributor.get("contributor_id"))])
+        for number, dataset in enumerate(dmp.get("dataset") or [], 1):
+            rows["datasets"].append([planid, number, dataset.get("type"), dataset.get("title"),
+                                     dataset.get("description"), dataset.get("personal_data"),
+                                     dataset.get("sensitive_data"), _identifier(dataset.get("dataset_id"))])
+
+
+def flatten_v0(planid, plans, rows):
+    # Rows of an API V0 file: the plan and every answered question
+    for plan in plans:
+        planid = str(plan.get("id") or planid)
+        template = plan.get("template") or {}
+        rows["plans"].append([planid, "v0", plan.get("title"), plan.get("description"), None, plan.get("created"),
+                              plan.get("updated"), None, None, None, template.get("id"), template.get("title"),
+                              None, plan.get("grant_number")])
+        for phase in plan.get("plan_content") or []:
+            for section in phase.get("sections") or []:
+                for question in section.get("questions") or []:
+                    answer = question.get("answer") or {}
+                    options = [option.get("text") for option in answer.get("options") or [] if option.get("text")]
+                    text = "; ".join(options + ([answer["text"]] if answer.get("text") else []))
+                    if not text:
+                        continue
+                    rows["answers"].append([planid, phase.get("title"), section.get("title"),
+                                            question.get("number"), question.get("text"), text])
+
+
+def flatten_file(path):
+    # (file name, {table: rows}, error) for one downloaded plan file, run in the worker processes
+    name = os.path.basename(path)
+    planid, version = FILE_PATTERN.match(name).groups()
+    rows = {table: [] for table in TABLES}
+    try:
+        with open(path, encoding="utf-8") as plan_file:
+            data = json.load(plan_file)
+    except (OSError, ValueError) as e:
+        return name, None, str(e)
+    if version == "V0V1":
+        # Both answers in one record, see dmponline2_file.py
+        flatten_v1(planid, data.get("v1") or [], rows)
+        flatten_v0(planid, data.get("v0") or [], rows)
+    else:
+        if isinstance(data, dict):
+            data = data.get("items") or [data]
+        if version == "V1":
+            flatten_v1(planid, data, rows)
+        else:
+            flatten_v0(planid, data, rows)
+    for table_rows in rows.values():
+        for row in table_rows:
+            row[:] = [_text(value) for value in row]
+    return name, rows, None
+
+
+def _connection(path):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)")
+    for table, columns in TABLES.items():
+        db.execute("CREATE TABLE IF NOT EXISTS " + table + " (source TEXT NOT NULL, " +
+                   ", ".join('"' + column + '"' for column in columns) + ")")
+        db.execute("CREATE INDEX IF NOT EXISTS " + table + "_source ON " + table + " (source)")
+    return db
+
+
+def scan(directory):
+    # {file name: (mtime_ns, size)} of the downloaded plan files
+    files = {}
+    if not os.path.isdir(directory):
+        return files
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and FILE_PATTERN.match(entry.name):
+                stat = entry.stat()
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def update_files(db, directory, parse, store, processes=1, full=False):
+    # Brings a database with a files table (name, mtime_ns, size) up to date with the plan files in
+    # directory, also for plan_search.py. Files that are new or changed (size or modification time)
+    # are parsed by parse(path) -> (name, result, error), in a pool of processes if processes > 1,
+    # and stored with store(name, result) as the results come in. Removed files get
+    # store(name, None). Returns (parsed, removed, errors)
+    on_disk = scan(directory)
+    known = {name: (mtime_ns, size) for name, mtime_ns, size in db.execute("SELECT name, mtime_ns, size FROM files")}
+    changed = sorted(name for name, stat in on_disk.items() if full or known.get(name) != stat)
+    removed = sorted(name for name in known if name not in on_disk)
+    if not changed and not removed:
+        return 0, 0, {}
+    paths = [os.path.join(directory, name) for name in changed]
+    errors = {}
+
+    def store_all(results):
+        for name, result, error in results:
+            if error is not None:
+                errors[name] = error
+                continue
+            store(name, result)
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (name,) + on_disk[name])
+
+    with db:
+        for name in removed:
+            store(name, None)
+            db.execute("DELETE FROM files WHERE name = ?", (name,))
+        if processes > 1 and len(paths) > CHUNK_SIZE:
+            with Pool(processes) as pool:
+                store_all(pool.imap_unordered(parse, paths, CHUNK_SIZE))
+        else:
+            store_all(map(parse, paths))
+    return len(changed) - len(errors), len(removed), errors
+
+
+def update(db, directory, processes=1, full=False):
+    # Brings the SQLite tables up to date with directory. Returns (parsed, removed, errors)
+
+    def store(name, rows):
+        for table, columns in TABLES.items():
+            db.execute("DELETE FROM " + table + " WHERE source = ?", (name,))
+            if rows is not None and rows[table]:
+                db.executemany("INSERT INTO " + table + " VALUES (" + ", ".join("?" * (len(columns) + 1)) + ")",
+                               [[name] + row for row in rows[table]])
+
+    return update_files(db, directory, flatten_file, store, processes, full)
+
+
+def write_csv(db, table, path):
+    columns = TABLES[table]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(columns)
+        writer.writerows(db.execute("SELECT " + ", ".join('"' + column + '"' for column in columns) +
+                                    " FROM " + table + " ORDER BY rowid"))
+    os.replace(tmp_path, path)
+
+
+def write_parquet(db, table, path):
+    import pyarrow
+    import pyarrow.parquet
+
+    columns = TABLES[table]
+    cursor = db.execute("SELECT " + ", ".join('"' + column + '"' for column in columns) +
+                        " FROM " + table + " ORDER BY rowid")
+    values = list(zip(*cursor)) or [()] * len(columns)
+    arrow_table = pyarrow.table({column: pyarrow.array(list(value), type=pyarrow.string())
+                                 for column, value in zip(columns, values)})
+    tmp_path = path + ".tmp"
+    pyarrow.parquet.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export(db, directory, file_format):
+    # Writes every table to directory, returns {table: rows}
+    counts = {}
+    writer = write_parquet if file_format == "parquet" else write_csv
+    for table in TABLES:
+        writer(db, table, os.path.join(directory, table + "." + file_format))
+        counts[table] = db.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+    return counts
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Export the downloaded plans as flat CSV or Parquet tables.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-f", "--format", choices=["csv", "parquet"], default="csv",
+                        help="Table format, parquet needs pyarrow")
+    parser.add_argument("-p", "--processes", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes parsing plan files")
+    parser.add_argument("-i", "--input", default=dmp_files.DOWNLOAD_DIR, help="Folder with the downloaded plans")
+    parser.add_argument("-o", "--output", default=EXPORT_DIR, help="Folder for the tables")
+    parser.add_argument("--full", action="store_true", help="Parse every file again, not only the changed ones")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            print("Parquet needs pyarrow (pip install pyarrow), or use --format csv. Exiting.")
+            exit()
+
+    started = time.monotonic()
+    os.makedirs(args.output, exist_ok=True)
+    db = _connection(os.path.join(args.output, STATE_DB))
+    parsed, removed, errors = update(db, args.input, args.processes, args.full)
+    for name, error in sorted(errors.items()):
+        sys.stderr.write("Could not read " + name + ": " + error + "\n")
+    print("Parsed " + str(parsed) + " new or changed files, removed " + str(removed) + ", " +
+          str(len(errors)) + " unreadable.")
+
+    # The tables are only written again when something changed
+    paths = [os.path.join(args.output, table + "." + args.format) for table in TABLES]
+    if parsed or removed or not all(os.path.exists(path) for path in paths):
+        counts = export(db, args.output, args.format)
+    else:
+        counts = {table: db.execute("SELECT COUNT(*) FROM " + table).fetchone()[0] for table in TABLES}
+        print("Nothing changed since the last export.")
+    db.close()
+    for table, count in counts.items():
+        if args.verbose or count:
+            print("  " + os.path.join(args.output, table + "." + args.format) + ": " + str(count) + " rows")
+    print("Done in " + "%.1f" % (time.monotonic() - started) + " s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import dmp_auth
+import dmp_http
+
+# Paging through DMPonline API v1 listings (templates, plans).
+# The first page tells how many items there are, the remaining pages are then
+# fetched concurrently. Pages are always yielded in order.
+
+MAX_PER_PAGE = 100  # the largest page size DMPonline allows
+
+
+def fetch_page(endpoint, page, per_page=MAX_PER_PAGE):
+    # Request one page of a listing using the authentication token
+    dmp_list_url = os.getenv("DMPONLINE_API_URL") + endpoint
+    list_headers = {'Accept': 'application/json'}
+    list_params = {'page': page, 'per_page': per_page}
+    response = dmp_auth.get(url=dmp_list_url, headers=list_headers, params=list_params)
+    dmp_http.raise_for_status(response)
+    return json.loads(response.text)
+
+
+def iter_pages(endpoint, workers=4, per_page=MAX_PER_PAGE, verbose=False, known_pages=None):
+    # Yields every page in order. Once the first page gives the total the rest
+    # are prefetched concurrently, otherwise the "next" links are followed.
+    # known_pages ({page number: data}, e.g. from a resumed run) are used instead of fetched.
+    known_pages = known_pages or {}
+
+    def get(page):
+        if page in known_pages:
+            return known_pages[page]
+        return fetch_page(endpoint, page, per_page)
+
+    first = get(1)
+    yield first
+    total = first.get("total_items")
+    per_page = first.get("per_page") or per_page
+    if total is None:
+        page = 1
+        data = first
+        while data.get("next") and data.get("items"):
+            page += 1
+            data = get(page)
+            yield data
+        return
+
+    pages = math.ceil(total / per_page)
+    if verbose:
+        print(str(total) + " " + endpoint + " on " + str(pages) + " pages")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for data in pool.map(get, range(2, pages + 1)):
+            yield data
+
+
+def iter_items(endpoint, workers=4, verbose=False):
+    for data in iter_pages(endpoint, workers=workers, verbose=verbose):
+        for item in data.get("items") or []:
+            yield item
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import codecs
+import json
+import os
+import re
+import shutil
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import dmp_auth
+import dmp_files
+import dmp_http
+import dmp_metrics
+import plan_archive
+
+# Fetching and storing plans from DMPonline, shared by dmponline2_file_v0.py,
+# dmponline2_file_v1.py and dmponline2_file.py (both APIs in one record). Bulk downloads run
+# with asyncio: every plan is fetched on the shared pooled session (in a worker thread) and at
+# most `concurrency` plans are in flight at the same time. Each plan is written to
+# Downloaded_plans as soon as it arrives.
+# Answers are streamed: the v1 items are parsed incrementally and written one at a time, and
+# files are only renamed into place once completely written.
+# Every answer is streamed into the plan archive (see plan_archive.py), which keeps each
+# version of a plan once, compressed. The plan file is written from the archive, and only
+# when the plan changed: an unchanged plan only costs a temporary compressed copy.
+
+DOWNLOAD_DIR = dmp_files.DOWNLOAD_DIR
+CHUNK_SIZE = 64 * 1024
+
+_JSON_SPECIAL = re.compile(r'["{}\[\],:]')
+_JSON_STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+
+def parse_plan_ids(values, id_file=""):
+    # Plan ids from the command line ("123456", "123456-123470", "1,2,3") and/or a file with one id per line
+    planids = []
+    for value in values:
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if "-" in part:
+                first, last = part.split("-", 1)
+                planids.extend(str(planid) for planid in range(int(first), int(last) + 1))
+            else:
+                planids.append(part)
+    if id_file:
+        with open(id_file, encoding="utf-8") as idf:
+            planids.extend(line.strip() for line in idf if line.strip() and not line.startswith("#"))
+    # Keep the order, drop duplicates
+    return list(dict.fromkeys(planids))
+
+
+def plan_path(planid, version):
+    if not os.path.exists(DOWNLOAD_DIR):
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    return os.path.join(DOWNLOAD_DIR, planid + "_API_" + version + "_dmp.json")
+
+
+def _text_chunks(response):
+    # Decoded text chunks of a streamed response, never the whole body at once
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def iter_json_array(chunks, key="items"):
+    # Incremental JSON parser: yields the elements of the top level array `key`
+    # one at a time, only the element currently being read is kept in memory.
+    buf = ""
+    pos = 0
+    depth = 0
+    last_string = None
+    key_seen = False
+    array_depth = None
+    start = None
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            match = _JSON_SPECIAL.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            ch = match.group()
+            i = match.start()
+            if ch == '"':
+                end = _JSON_STRING_END.match(buf, i + 1)
+                if end is None:
+                    pos = i  # the string continues in the next chunk
+                    break
+                if array_depth is None and depth == 1:
+                    last_string = buf[i + 1:end.end() - 1]
+                pos = end.end()
+                continue
+            pos = i + 1
+            if array_depth is None:
+                if ch == ":":
+                    key_seen = depth == 1 and last_string == key
+                elif ch == "[" and key_seen:
+                    depth += 1
+                    array_depth = depth
+                    start = pos
+                else:
+                    key_seen = False
+                    if ch in "{[":
+                        depth += 1
+                    elif ch in "}]":
+                        depth -= 1
+                continue
+            if ch in "{[":
+                depth += 1
+            elif ch in "}]" and depth > array_depth:
+                depth -= 1
+            elif ch == "," and depth == array_depth:
+                yield json.loads(buf[start:i])
+                start = pos
+            elif ch == "]":
+                element = buf[start:i]
+                if element.strip():
+                    yield json.loads(element)
+                return
+        # Drop what has been consumed
+        cut = pos if start is None else min(start, pos)
+        buf = buf[cut:]
+        pos -= cut
+        if start is not None:
+            start -= cut
+    raise ValueError('No "' + key + '" array in the response')
+
+
+def _write_items(out_file, plan_items):
+    # Same layout as json.dumps(plan_items, indent=2), one item at a time
+    count = 0
+    out_file.write("[")
+    for item in plan_items:
+        out_file.write(",\n" if count else "\n")
+        out_file.write(textwrap.indent(json.dumps(item, indent=2), "  "))
+        count += 1
+    out_file.write("\n]" if count else "]")
+
+
+def _store(planid, version, write):
+    # Streams the answer written by write(out_file) into the plan archive. The plan file is only
+    # written, from the archived blob, if the answer changed (or the file is missing), so an
+    # unchanged plan leaves Downloaded_plans alone and a plan file is never half written.
+    path = plan_path(planid, version)
+    blob = plan_archive.BlobWriter()
+    try:
+        write(blob)
+        if plan_archive.commit(planid, version, blob) or not os.path.exists(path):
+            plan_archive.extract(blob.close(), path, blob.directory)
+    finally:
+        blob.discard()
+    return path
+
+
+def _fetch_to_file(fetch, path):
+    with open(path, "w", encoding="utf-8") as out_file:
+        fetch(out_file)
+
+
+def _copy_file(path, out_file):
+    with open(path, encoding="utf-8") as in_file:
+        shutil.copyfileobj(in_file, out_file, CHUNK_SIZE)
+
+
+def fetch_plan_v0(planid, out_file):
+    # The v0 API uses the API key directly, no authenticate call needed.
+    # The answer is written as is.
+    plan_headers = {
+        'Authorization': 'Token token=' + os.getenv("DMPONLINE_AUTH_CODE"),
+        'Content-Type': 'application/json',
+    }
+    dmp_plan_url = os.getenv("DMPONLINE_API_URL_V0") + "plans?plan=" + planid
+    with dmp_http.get(url=dmp_plan_url, headers=plan_headers, stream=True) as response:
+        dmp_http.raise_for_status(response)
+        out_file.writelines(_text_chunks(response))
+
+
+def fetch_plan_v1(planid, out_file):
+    # The items of the v1 answer are parsed and written one by one
+    dmp_plan_url = os.getenv("DMPONLINE_API_URL") + "plans/" + planid
+    plan_headers = {"Accept": "application/json"}
+    with dmp_auth.get(url=dmp_plan_url, headers=plan_headers, stream=True) as response:
+        dmp_http.raise_for_status(response)
+        _write_items(out_file, iter_json_array(_text_chunks(response)))
+
+
+def download_plan_v0(planid):
+    return _store(planid, "V0", partial(fetch_plan_v0, planid))
+
+
+def download_plan_v1(planid):
+    return _store(planid, "V1", partial(fetch_plan_v1, planid))
+
+
+async def download_plan_combined(planid):
+    # Both answers of a plan, fetched at the same time, in one record:
+    # {"plan_id": ..., "v1": [RDA items], "v0": [v0 plan]} stored as <id>_API_V0V1_dmp.json.
+    # Both answers are streamed to temporary files first and then copied into the record.
+    path = plan_path(planid, "V0V1")
+    v1_path, v0_path = path + ".v1.tmp", path + ".v0.tmp"
+
+    def write(out_file):
+        out_file.write('{\n  "plan_id": ' + json.dumps(planid) + ',\n  "v1": ')
+        _copy_file(v1_path, out_file)
+        out_file.write(',\n  "v0": ')
+        _copy_file(v0_path, out_file)
+        out_file.write("\n}")
+
+    try:
+        await asyncio.gather(asyncio.to_thread(_fetch_to_file, partial(fetch_plan_v1, planid), v1_path),
+                             asyncio.to_thread(_fetch_to_file, partial(fetch_plan_v0, planid), v0_path))
+        return await asyncio.to_thread(_store, planid, "V0V1", write)
+    finally:
+        for part_path in (v1_path, v0_path):
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+
+def store_plan_items(planid, plan_items):
+    return _store(planid, "V1", lambda out_file: _write_items(out_file, plan_items))
+
+
+plan_id_of = dmp_files.plan_id_of
+
+
+async def _download(planid, download, semaphore, journal):
+    async with semaphore:
+        if journal is not None:
+            journal.start(planid)
+        try:
+            if asyncio.iscoroutinefunction(download):
+                path = await download(planid)
+            else:
+                path = await asyncio.to_thread(download, planid)
+            return planid, path, None
+        except Exception as e:
+            return planid, None, e
+
+
+async def _download_all(planids, download, concurrency, report, journal, executor):
+    # The worker threads of to_thread come from the default executor, set to one sized for
+    # `concurrency` plans (two threads each, a combined plan fetches v0 and v1 at once)
+    asyncio.get_running_loop().set_default_executor(executor)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(_download(planid, download, semaphore, journal)) for planid in planids]
+    failed = []
+    for task in asyncio.as_completed(tasks):
+        planid, path, error = await task
+        if error is not None:
+            failed.append(planid)
+        dmp_metrics.inc("plans_downloaded", status="failed" if error is not None else "ok")
+        if journal is not None:
+            if error is not None:
+                journal.fail(planid, error)
+            else:
+                journal.complete(planid, path)
+        report(planid, path, error)
+    return failed
+
+
+def download_plans(planids, download, concurrency=8, report=None, journal=None):
+    # Download all planids, returns the ids that failed. With a journal (see run_journal.py)
+    # every started, downloaded and failed plan is recorded.
+    if report is None:
+        report = _print_result
+    executor = ThreadPoolExecutor(max_workers=concurrency * 2, thread_name_prefix="download")
+    try:
+        return asyncio.run(_download_all(planids, download, concurrency, report, journal, executor))
+    finally:
+        executor.shutdown()
+
+
+def _print_result(planid, path, error):
+    if error is not None:
+        print(planid + ": failed (" + str(error) + ")")
+    else:
+        print(planid + ": stored as " + path)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests
+import json
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+import os
+
+import dmp_auth
+import dmp_http
+import dmp_metrics
+import madmp
+import swecris_to_dmponline
+import upload_ledger
+
+# Simple script that updates the plans created by these scripts when their SweCRIS data has
+# changed (new end date, title, people). For every plan in the upload ledger the maDMP record
+# is rebuilt from SweCRIS (through the local cache) and the hash of its SweCRIS derived parts
+# (project with funding, contributors) is compared with the hash recorded for the plan, see
+# madmp.source_hash(). Only plans whose hash differs are fetched from DMPonline, get the new
+# parts and are written back with PUT. Everything else in the plan is left as it is.
+# Plans created before hashes were recorded get the current hash as their baseline.
+# Example: ./python3 dmponline_reconcile.py --dry-run
+#
+# // matves29@kth.se
+
+# Settings
+load_dotenv()  # loads the .env file which contains login-information
+dmpurl = os.getenv("DMPONLINE_API_URL")
+logfile = os.getenv("LOGFILE")
+
+yes = {"yes", "y", "ye", "j", "ja", ""}
+no = {"no", "n", "nej"}
+
+
+def plan_url(dmp_id):
+    # API url of a plan from its dmp_id (the API url, or an institutional url ending in the plan id)
+    return os.getenv("DMPONLINE_API_URL") + "plans/" + dmp_id.rstrip("/").rsplit("/", 1)[-1]
+
+
+def check_plan(plan, use_cache=True):
+    # Rebuilds the record of a ledger entry. Returns (status, record, source hash), status is
+    # unchanged, changed, unhashed (no hash recorded yet) or missing (not in SweCRIS)
+    swecrisid = plan["swecrisid"]
+    funder = madmp.funder_of(swecrisid)
+    if funder is None:
+        return "missing", None, None
+    grantid = swecrisid.rsplit("_", 1)[0]
+    swecrisid, funder_ror = madmp.funder_params(grantid, funder)
+    swecrisdata = swecris_to_dmponline.fetch_swecris(swecrisid, use_cache)
+    if swecrisdata is None:
+        return "missing", None, None
+    jsondmp = swecris_to_dmponline.build_madmp(swecrisdata, swecrisid, funder, funder_ror, plan["lang"] or "eng",
+                                               "", plan["email"], plan["template"])
+    source_hash = madmp.source_hash(jsondmp)
+    if not plan["source_hash"]:
+        return "unhashed", jsondmp, source_hash
+    if plan["source_hash"] == source_hash:
+        return "unchanged", jsondmp, source_hash
+    return "changed", jsondmp, source_hash
+
+
+def contributor_key(contributor):
+    # Identifies a contributor across SweCRIS and DMPonline: the ORCID if there is one, else the name
+    contributor_id = contributor.get("contributor_id") or {}
+    if contributor_id.get("type") == "orcid" and contributor_id.get("identifier"):
+        return "orcid:" + contributor_id["identifier"].strip().rstrip("/").rsplit("/", 1)[-1]
+    return "name:" + " ".join((contributor.get("name") or "").lower().split())
+
+
+def merge(current, jsondmp):
+    # The plan as DMPonline has it, with the SweCRIS derived parts replaced. The e-mail address
+    # and role of a contributor that is still in SweCRIS are kept as edited in DMPonline, other
+    # contributors with an e-mail address were added in DMPonline (SweCRIS has no addresses)
+    # and are kept as well.
+    dmp = current["dmp"]
+    new = jsondmp["items"][0]["dmp"]
+    dmp["title"] = new["title"]
+    dmp["description"] = new["description"]
+    dmp["project"] = new["project"]
+    edited = {contributor_key(contributor): contributor for contributor in dmp.get("contributor") or []}
+    contributors = []
+    for contributor in new["contributor"]:
+        old = edited.pop(contributor_key(contributor), {})
+        contributors.append(dict(contributor, **{field: old[field] for field in ("mbox", "role") if old.get(field)}))
+    dmp["contributor"] = contributors + [contributor for contributor in edited.values() if contributor.get("mbox")]
+    return {"total_items": 1, "items": [current]}
+
+
+def update_plan(plan, jsondmp, source_hash):
+    # Writes the new SweCRIS data into the plan in DMPonline and records the new hash
+    url = plan_url(plan["dmp_id"])
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+    response = dmp_auth.get(url=url, headers=headers)
+    dmp_http.raise_for_status(response)
+    current = json.loads(response.text)["items"][0]
+    response = dmp_auth.put(url=url, json=merge(current, jsondmp), headers=headers)
+    dmp_http.raise_for_status(response)
+    upload_ledger.set_source_hash(plan["swecrisid"], plan["email"], source_hash)
+    return "updated"
+
+
+def run_pool(units, process, workers):
+    # Runs process(unit) for all units concurrently, yields (unit, "ok", result) or (unit, "failed", error)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process, unit): unit for unit in units}
+        for future in as_completed(futures):
+            unit = futures[future]
+            try:
+                yield unit, "ok", future.result()
+            except (requests.exceptions.RequestException, dmp_auth.AuthenticationError, ValueError, KeyError,
+                    IndexError) as e:
+                yield unit, "failed", str(e)
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Update the plans in DMPonline whose SweCRIS data changed.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-i", "--grantid", nargs="*", default=[],
+                        help="Only these grants (grant ids or SweCRIS ids), default all plans in the ledger")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of plans checked or updated concurrently")
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch fresh data from SweCRIS, bypassing the local cache")
+    parser.add_argument("--update-unhashed", action="store_true", help="Update plans without a recorded hash "
+                                                                       "instead of taking their hash as baseline")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the plans that would be updated")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    plans = upload_ledger.plans()
+    if args.grantid:
+        wanted = set(args.grantid)
+        plans = [plan for plan in plans if plan["swecrisid"] in wanted or plan["swecrisid"].rsplit("_", 1)[0] in wanted]
+    if not plans:
+        print("No plans in the upload ledger (" + upload_ledger.LEDGER_FILE + "). Nothing to do.")
+        exit()
+
+    # Compare the hashes, only SweCRIS (mostly the local cache) is asked
+    counts = {}
+    changed = []
+    for plan, result, value in run_pool(plans, lambda plan: check_plan(plan, not args.no_cache), args.workers):
+        status, jsondmp, source_hash = ("failed", None, None) if result == "failed" else value
+        if status == "unhashed" and not args.update_unhashed and not args.dry_run:
+            upload_ledger.set_source_hash(plan["swecrisid"], plan["email"], source_hash, updated=False)
+            status = "baselined"
+        elif status == "unhashed" and args.update_unhashed:
+            status = "changed"
+        counts[status] = counts.get(status, 0) + 1
+        dmp_metrics.inc("reconcile_plans", status=status)
+        if status == "changed":
+            changed.append((plan, jsondmp, source_hash))
+        if status == "failed" or (args.verbose and status != "unchanged") or (args.dry_run and status == "changed"):
+            print(plan["swecrisid"] + ": " + status + (" (" + value + ")" if status == "failed" else ""))
+
+    print("Checked " + str(len(plans)) + " plans. " +
+          ", ".join(status.capitalize() + ": " + str(count) for status, count in sorted(counts.items())))
+    if args.dry_run or not changed:
+        exit()
+
+    print("Should I update " + str(len(changed)) + " plans in DMP Online? (y/n)")
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+        updated = 0
+        failed = 0
+        for (plan, jsondmp, source_hash), result, value in run_pool(changed, lambda change: update_plan(*change),
+                                                                     args.workers):
+            status = value if result == "ok" else "failed"
+            dmp_metrics.inc("reconcile_plans", status=status)
+            if status == "updated":
+                updated += 1
+            else:
+                failed += 1
+            print(plan["swecrisid"] + ": " + status + " (" + (plan["dmp_id"] if result == "ok" else value) + ")")
+        print("Done. Updated: " + str(updated) + ", failed: " + str(failed))
+
+    elif choice in no:
+        print("OK. Will exit then.")
+        exit()
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
+
+    exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests
+import json
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from dotenv import load_dotenv
+from datetime import datetime, timezone
+import os
+
+import dmp_auth
+import dmp_files
+import dmp_metrics
+import dmponline_pages
+import dmponline_plans
+
+# Simple script that keeps Downloaded_plans in sync with DMPonline (API V1).
+# The plans listing is walked page by page and only plans whose modified value differs from
+# the one stored for them at the last sync (in Downloaded_plans/.sync_state.json) or that
+# were never seen before are written. The whole listing is walked on every sync, as only a
+# complete walk tells which plans are gone. Plans that are no longer in the listing (deleted
+# or no longer visible) are tombstoned: the file is renamed to <id>_API_V1_dmp.deleted.json.
+# Example: ./python3 dmponline_sync.py --yes
+#
+# // matves29@kth.se
+
+# Settings
+load_dotenv()  # loads the .env file which contains login-information
+dmpurl = os.getenv("DMPONLINE_API_URL")
+logfile = os.getenv("LOGFILE")
+
+yes = {"yes", "y", "ye", "j", "ja", ""}
+no = {"no", "n", "nej"}
+
+STATE_FILE = dmp_files.SYNC_STATE_FILE
+
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path, encoding="utf-8") as sf:
+            return json.load(sf)
+    except (OSError, ValueError):
+        return {"plans": {}, "tombstones": {}}
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as sf:
+        json.dump(state, sf, indent=2)
+    os.replace(tmp_path, path)
+
+
+def tombstone(planid):
+    path = dmponline_plans.plan_path(planid, "V1")
+    if os.path.exists(path):
+        os.replace(path, path[:-len(".json")] + ".deleted.json")
+
+
+def sync(state, workers=4, full=False, verbose=False):
+    # Returns (written, unchanged, tombstoned) plan ids, and updates state in place. A plan is
+    # written if its modified value is not the one stored for it, or with full always.
+    known = state.get("plans", {})
+    seen = {}
+    written = []
+    unchanged = []
+
+    for item in dmponline_pages.iter_items("plans", workers=workers, verbose=verbose):
+        planid = dmponline_plans.plan_id_of(item)
+        modified = item["dmp"].get("modified")
+        seen[planid] = modified
+        if (full or modified is None or known.get(planid) != modified
+                or not os.path.exists(dmponline_plans.plan_path(planid, "V1"))):
+            dmponline_plans.store_plan_items(planid, [item])
+            written.append(planid)
+            if verbose:
+                print(planid + ": updated (modified " + str(modified) + ")")
+        else:
+            unchanged.append(planid)
+
+    # Only a complete walk of the listing tells which plans are gone
+    tombstoned = [planid for planid in known if planid not in seen]
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    tombstones = state.setdefault("tombstones", {})
+    for planid in tombstoned:
+        tombstone(planid)
+        tombstones[planid] = now
+        if verbose:
+            print(planid + ": no longer in DMPonline, tombstoned")
+    for planid in seen:
+        tombstones.pop(planid, None)
+
+    state["plans"] = seen
+    state.pop("watermark", None)  # kept by earlier versions, no longer used
+    state["last_sync"] = now
+    for result, planids in (("written", written), ("unchanged", unchanged), ("tombstoned", tombstoned)):
+        dmp_metrics.inc("sync_plans", len(planids), result=result)
+    return written, unchanged, tombstoned
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Sync Downloaded_plans with the plans in DMPonline (API V1).",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of listing pages fetched concurrently")
+    parser.add_argument("--full", action="store_true", help="Rewrite every plan, also those whose modified value did not change")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    state = load_state()
+    print("Last sync: " + str(state.get("last_sync")) + ", known plans: " + str(len(state.get("plans", {}))))
+    print("Should I sync Downloaded_plans with DMPonline? (y/n)")
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+        try:
+            written, unchanged, tombstoned = sync(state, workers=args.workers, full=args.full, verbose=args.verbose)
+        except (requests.exceptions.RequestException, dmp_auth.AuthenticationError) as e:
+            # The state is left untouched so the next sync compares with the same stored values
+            print("Sync failed! " + str(e))
+            exit()
+        save_state(state)
+        print("Done. Updated: " + str(len(written)) + ", unchanged: " + str(len(unchanged)) +
+              ", tombstoned: " + str(len(tombstoned)))
+
+    elif choice in no:
+        print("OK. Will exit then.")
+        exit()
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
+
+    exit()
+
+
+if __name__ == "__main__":
+    main()
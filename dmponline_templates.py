@@ -6,101 +6,133 @@ import json
 import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from dotenv import load_dotenv
-from datetime import datetime
 import os
-import uuid
 import time
 
+import dmp_auth
+import dmp_metrics
+import dmponline_pages
+import run_journal
+import template_index
+
 # Simple script that harvests all templates from DMPonline in order to get correct template ids.
-# Todo: currently only get up to 100 entries (1 page). At the moment this is sufficient.
-# Example: ./python3 dmponline_export_templates.py 
+# All pages are fetched: the first page tells how many templates there are, the remaining
+# pages are then fetched concurrently and their items streamed into the output file in order.
+# Example: ./python3 dmponline_templates.py
 #
 # / urban.andersson@chalmers.se
 # // matves29@kth.se
 
 # Settings
-load_dotenv()  # loads the .env file which contains login-information 
+load_dotenv()  # loads the .env file which contains login-information
 dmpurl = os.getenv("DMPONLINE_API_URL")
 dmpuser = os.getenv("DMPONLINE_USER")
 dmppw = os.getenv("DMPONLINE_PW")
 dmp_id_prefix = os.getenv("DMP_ID_PREFIX")
 logfile = os.getenv("LOGFILE")
 
-# Input params
-parser = ArgumentParser(description="Create new DMP using data from Swecris.",
-                        formatter_class=ArgumentDefaultsHelpFormatter)
-parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
-#parser.add_argument("-i", "--grantid", default="", help="Grant ID, i.e. 2023-012345", required=True)
-args = parser.parse_args()
+yes = {'yes', 'y', 'ye', 'j', 'ja', ''}
+no = {'no', 'n', 'nej'}
 
-# Create Swecris ID and look up corresponding project in Swecris API
-#grantid = args.grantid
 
+def harvest(path, workers=4, verbose=False, journal=None):
+    # Streams all template items into path as {"items": [...], "total_items": n}
+    # and updates the local template index (see template_index.py), returns n.
+    # With a journal (see run_journal.py) every page is recorded, and the pages of
+    # an interrupted run are taken from it instead of fetched again.
+    known_pages = {}
+    if journal is not None:
+        known_pages = {int(page): data for page, data in journal.completed.items()}
+    count = 0
+    items = []
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out_file:
+        out_file.write('{"items": [')
+        pages = dmponline_pages.iter_pages('templates', workers=workers, verbose=verbose, known_pages=known_pages)
+        for page, data in enumerate(pages, 1):
+            if journal is not None and page not in known_pages:
+                journal.complete(str(page), data)
+            for item in data.get("items", []):
+                out_file.write(",\n" if count else "\n")
+                out_file.write(json.dumps(item, ensure_ascii=False))
+                items.append(item)
+                count += 1
+            if verbose:
+                print("Page " + str(data.get("page", "?")) + ": " + str(len(data.get("items", []))) + " templates")
+        out_file.write('\n], "total_items": ' + str(count) + '}\n')
+    os.replace(tmp_path, path)
+    added, changed, removed = template_index.update_index(items)
+    dmp_metrics.inc("templates", count)
+    if verbose:
+        print("Template index: " + str(added) + " added, " + str(changed) + " changed, " + str(removed) + " removed")
+    return count
 
-# Go ahead and create DMP in DMPOnline from here...
-print('Should I fetch all templates from DMPonline? (y/n)')
-yes = {'yes', 'y', 'ye', 'j', 'ja', ''}
-no = {'no', 'n', 'nej'}
-choice = input().lower()
-if choice in yes:
-
-    # Authorize
-    dmp_auth_bearer = ""
-    dmp_auth_url = os.getenv("DMPONLINE_API_URL") + "authenticate"
-    auth_headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-    }
-    auth_body = {
-        "grant_type": "authorization_code",
-        "email": os.getenv("DMPONLINE_USER"),
-        "code": os.getenv("DMPONLINE_AUTH_CODE"),
-    }
-    try:
-        authdata = requests.post(
-            url=dmp_auth_url, json=auth_body, headers=auth_headers
-        ).text
-            
-        if "Internal server error" in authdata:
-            print("Authentication request failed! Exiting.")
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Harvest all templates from DMPonline.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of pages fetched concurrently")
+    parser.add_argument("--resume", action="store_true", help="Go on with an interrupted harvest, reusing the pages "
+                                                             "it already fetched (see Journals/)")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    print('Should I fetch all templates from DMPonline? (y/n)')
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+
+        # Authorize (the token is cached between runs, see dmp_auth.py)
+        try:
+            dmp_auth_bearer = dmp_auth.get_token()
+            if dmp_auth_bearer is None:
+                print("Authentication request failed! Exiting.")
+                exit()
+
+            print("Authorized!")
+
+        except requests.exceptions.HTTPError as e:
+            print("Failed! authdata: " + str(e))
             exit()
 
-        authdata = json.loads(authdata)
-        dmp_auth_bearer = authdata["access_token"]
-            
-        print("Authorized! Access token: " + dmp_auth_bearer)
+        # Request all pages of templates
+        try:
+            if not os.path.exists('Templates'):
+                os.makedirs('Templates')
 
-    except requests.exceptions.HTTPError as e:
-        print("Failed! authdata: " + authdata)
-        exit()
+            timestr = time.strftime("%Y%m%d-%H%M%S")
+            filename = "Templates_from_DMPonline_" + timestr + ".json"
+            path = os.path.join('Templates', filename)
+            journal = run_journal.Journal("templates", resume=args.resume)
+            if args.resume:
+                print("Resuming: " + journal.summary())
+            try:
+                count = harvest(path, workers=args.workers, verbose=args.verbose, journal=journal)
+                journal.close(finished=True)
+            finally:
+                journal.close()
+            print("Fetched " + str(count) + " templates.")
+            print("Stored as: " + path)
+            print("Template index updated: " + template_index.INDEX_FILE)
+
+        except requests.exceptions.HTTPError as e:
+            print('Failed! templatedata: ' + str(e))
+            exit()
 
-        # Request templates using the authentication token (mainly as a test)
-    try:
-        dmp_template_url = os.getenv("DMPONLINE_API_URL") + 'templates'
-        template_headers = {'Accept': 'application/json','Authorization': 'Bearer ' + dmp_auth_bearer}
-                
-        templatedata = requests.get(url=dmp_template_url, headers=template_headers).text
-        print(templatedata)
-        if not os.path.exists('Templates'):
-            os.makedirs('Templates')
-        
-        timestr = time.strftime("%Y%m%d-%H%M%S") 
-        filename = "Templates_from_DMPonline_" + timestr + ".json"
-        path = os.path.join('Templates', filename)
-        out_file = open(path, "w",encoding="utf-8") 
-        out_file.write(templatedata) 
-        out_file.close()
-        print("Stored as: " + path)
-       
-                  
-    except requests.exceptions.HTTPError as e:
-        print('Failed! templatedata: ' + templatedata)          
+    elif choice in no:
+        print('OK. Will exit then.')
         exit()
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
 
-elif choice in no:
-    print('OK. Will exit then.')
     exit()
-else:
-    sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
 
-exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import random
+import threading
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import dmp_metrics
+
+# Local stand-ins for the SweCRIS API and the DMPonline API (v0 and v1), for testing and
+# load testing the scripts without touching the real services. Only the endpoints the
+# scripts use are implemented, with generated but stable data:
+#   SweCRIS:   GET /v1/projects/{id}, /v1/organisations, /v1/projects/organisations/{id}
+#   DMPonline: POST /api/v1/authenticate, GET /api/v1/templates, GET/POST /api/v1/plans,
+#              GET /api/v1/plans/{id}, GET /api/v0/plans?plan={id}
+# Latency, error rate, throttling and page sizes can be set, GET /stats gives the request counts.
+# Point the .env file at them (printed on start) or use loadtest.py, which starts them itself.
+# Example: ./python3 fake_servers.py --latency 0.05 --error-rate 0.01 --rate-limit 50
+
+ORG_ID = "202100-3054"
+FUNDER_SUFFIXES = ["VR", "Formas", "Forte", "Vinnova"]
+TOKEN = "fake-token"
+API_KEY = "fake-api-key"
+
+
+class FakeState:
+    # Settings and counters shared by the handler threads of one server
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0.0, projects=1000,
+                 templates=250, plans=1000, max_per_page=100, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.projects = projects
+        self.templates = templates
+        self.plans = plans
+        self.max_per_page = max_per_page
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.window = []  # start times of the requests in the last second, for the rate limit
+        self.created = {}  # plans created with POST, by plan id
+        self.updated = {}  # plans written with PUT, by plan id
+        self.next_plan_id = 1000000
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def admit(self):
+        # "throttled", "error" or "ok" for a new request
+        with self.lock:
+            now = time.monotonic()
+            if self.rate_limit:
+                while self.window and self.window[0] < now - 1:
+                    self.window.pop(0)
+                if len(self.window) >= self.rate_limit:
+                    return "throttled"
+                self.window.append(now)
+            if self.error_rate and self.random.random() < self.error_rate:
+                return "error"
+            return "ok"
+
+    def delay(self):
+        with self.lock:
+            wait = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def create_plan(self, body):
+        with self.lock:
+            plan_id = self.next_plan_id
+            self.next_plan_id += 1
+            item = (body.get("items") or [{}])[0]
+            self.created[str(plan_id)] = item
+        return plan_id
+
+
+def project_id(number):
+    return "2020-%05d_%s" % (number, FUNDER_SUFFIXES[number % len(FUNDER_SUFFIXES)])
+
+
+def project(swecrisid):
+    # A generated SweCRIS project, None for ids this server does not know
+    grantid = swecrisid.rsplit("_", 1)[0]
+    if not grantid.startswith("20") or "-" not in grantid:
+        return None
+    number = grantid[len("2020-"):]
+    if grantid.startswith("2020-") and number.isdigit() and project_id(int(number)) != swecrisid:
+        return None  # the generated grants (project_id) are only known for their own funder
+    return {
+        "projectId": swecrisid,
+        "projectTitleEn": "Project " + grantid,
+        "projectTitleSv": "Projekt " + grantid,
+        "projectAbstractEn": "Abstract of project " + grantid + ". " * 20,
+        "projectAbstractSv": "Sammanfattning av projekt " + grantid + ".",
+        "projectStartDate": "2021-01-01 00:00:00",
+        "projectEndDate": "2024-12-31 00:00:00",
+        "fundingOrganisationNameEn": "Swedish Research Council",
+        "peopleList": [
+            {"fullName": "Person " + str(n), "roleEn": "Principal Investigator" if n == 0 else "Researcher",
+             "orcId": "0000-0000-0000-000" + str(n)}
+            for n in range(3)
+        ],
+    }
+
+
+def template(number):
+    return {"dmp_template": {
+        "title": "Template " + str(number),
+        "template_id": {"identifier": str(number), "type": "other"},
+        "affiliation": {"name": "Organisation " + str(number % 10)},
+        "funder": {"name": "Funder " + str(number % 5)},
+        "version": 1,
+        "published": True,
+        "modified": "2024-01-01T00:00:00Z",
+    }}
+
+
+def plan(base_url, plan_id, datasets=20):
+    return {"dmp": {
+        "title": "Plan " + str(plan_id),
+        "dmp_id": {"identifier": base_url + "api/v1/plans/" + str(plan_id), "type": "url"},
+        "modified": "2024-01-01T00:00:00Z",
+        "contact": {"name": "Contact " + str(plan_id), "mbox": "contact" + str(plan_id) + "@example.com"},
+        "project": [{"title": "Project of plan " + str(plan_id),
+                     "funding": [{"grant_id": {"identifier": "2019-%05d_VR" % (plan_id % 100000), "type": "other"}}]}],
+        "dataset": [{"title": "Dataset " + str(n), "description": "Generated dataset. " * 10} for n in range(datasets)],
+    }}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+    state = None  # set per server in make_server()
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, obj, code=200, headers=None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def base_url(self):
+        return "http://" + self.headers.get("Host", "127.0.0.1") + "/"
+
+    def page_params(self, query, page_name, size_name, default_size):
+        page = max(int(query.get(page_name, ["1"])[0]), 1)
+        size = min(max(int(query.get(size_name, [str(default_size)])[0]), 1), self.state.max_per_page)
+        return page, size
+
+    def handle_request(self, method):
+        body = b""
+        if self.headers.get("Content-Length"):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = parse_qs(parts.query)
+        if path == "/stats":
+            with self.state.lock:
+                self.send(dict(self.state.counts))
+            return
+
+        self.state.count(method + " " + dmp_metrics.endpoint(path))
+        admitted = self.state.admit()
+        self.state.delay()
+        if admitted == "throttled":
+            self.state.count("429")
+            self.send({"error": "Too many requests"}, 429, {"Retry-After": "1"})
+            return
+        if admitted == "error":
+            self.state.count("500")
+            self.send({"error": "Internal server error"}, 500)
+            return
+
+        if path.startswith("/v1/"):
+            self.swecris(method, path[len("/v1/"):], query)
+        elif path.startswith("/api/v1/"):
+            self.dmponline_v1(method, path[len("/api/v1/"):], query, body)
+        elif path.startswith("/api/v0/"):
+            self.dmponline_v0(method, path[len("/api/v0/"):], query)
+        else:
+            self.send({"error": "Not found"}, 404)
+
+    def swecris(self, method, path, query):
+        if self.headers.get("Authorization") != "Bearer " + API_KEY:
+            self.send({"error": "Unauthorized"}, 401)
+        elif path == "organisations":
+            self.send([{"organisationId": ORG_ID, "organisationNameEn": "KTH Royal Institute of Technology",
+                        "organisationNameSv": "Kungliga Tekniska högskolan"},
+                       {"organisationId": "202100-2817", "organisationNameEn": "Chalmers University of Technology"}])
+        elif path.startswith("projects/organisations/"):
+            page, size = self.page_params(query, "page", "pageSize", self.state.projects)
+            numbers = range((page - 1) * size, min(page * size, self.state.projects))
+            self.send([{"projectId": project_id(n), "projectTitleEn": "Project " + project_id(n).split("_")[0],
+                        "projectStartDate": "2021-01-01 00:00:00"} for n in numbers])
+        elif path.startswith("projects/"):
+            data = project(path[len("projects/"):])
+            if data is None:
+                # the real SweCRIS answers unknown ids like this
+                self.send({"message": "Internal server error"}, 500)
+                return
+            etag = '"' + hashlib.sha1(json.dumps(data).encode("utf-8")).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send(data, headers={"ETag": etag})
+        else:
+            self.send({"error": "Not found"}, 404)
+
+    def dmponline_v1(self, method, path, query, body):
+        if path == "authenticate" and method == "POST":
+            self.send({"access_token": TOKEN, "token_type": "Bearer", "expires_in": 7200,
+                       "created_at": int(time.time())})
+            return
+        if self.headers.get("Authorization") != "Bearer " + TOKEN:
+            self.send({"error": "Unauthorized"}, 401)
+        elif path == "templates":
+            self.listing("templates", query, self.state.templates, template)
+        elif path == "plans" and method == "POST":
+            plan_id = self.state.create_plan(json.loads(body or b"{}"))
+            self.send({"total_items": 1, "items": [plan(self.base_url(), plan_id, datasets=1)]}, 201)
+        elif path == "plans":
+            self.listing("plans", query, self.state.plans, lambda n: plan(self.base_url(), n + 1, datasets=1))
+        elif path.startswith("plans/"):
+            plan_id = path[len("plans/"):]
+            if not plan_id.isdigit() or not (0 < int(plan_id) <= self.state.plans or plan_id in self.state.created):
+                self.send({"error": "Not found"}, 404)
+                return
+            if method == "PUT":
+                item = (json.loads(body or b"{}").get("items") or [{}])[0]
+                with self.state.lock:
+                    self.state.updated[plan_id] = item
+                self.send({"total_items": 1, "items": [item]})
+                return
+            self.send({"total_items": 1, "items": [plan(self.base_url(), int(plan_id))]})
+        else:
+            self.send({"error": "Not found"}, 404)
+
+    def listing(self, endpoint, query, total, make_item):
+        page, size = self.page_params(query, "page", "per_page", 20)
+        items = [make_item(n) for n in range((page - 1) * size, min(page * size, total))]
+        answer = {"page": page, "per_page": size, "total_items": total, "items": items}
+        if page * size < total:
+            answer["next"] = self.base_url() + "api/v1/" + endpoint + "?page=" + str(page + 1) + "&per_page=" + str(size)
+        self.send(answer)
+
+    def dmponline_v0(self, method, path, query):
+        if self.headers.get("Authorization") != "Token token=" + API_KEY:
+            self.send({"error": "Unauthorized"}, 401)
+        elif path == "plans":
+            plan_id = query.get("plan", ["1"])[0]
+            self.send([{"id": int(plan_id) if plan_id.isdigit() else 0, "title": "Plan " + plan_id,
+                        "template": {"id": 1, "title": "Template 1"}, "plan_content": [{"title": "Section"}]}])
+        else:
+            self.send({"error": "Not found"}, 404)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default of 5 drops connections when many workers connect at once
+
+
+def make_server(state, port=0, host="127.0.0.1"):
+    # A server for `state`, port 0 picks a free port
+    handler = type("Handler", (FakeHandler,), {"state": state})
+    return FakeServer((host, port), handler)
+
+
+def start(state, port=0):
+    # Serves in a background thread, returns (server, base url)
+    server = make_server(state, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1]) + "/"
+
+
+def env_settings(swecris_url, dmponline_url):
+    # .env settings that point the scripts at the fake servers
+    return {
+        "SWECRIS_URL": swecris_url + "v1/projects/",
+        "SWECRIS_API_KEY": API_KEY,
+        "SWECRIS_ORG_ID": ORG_ID,
+        "DMPONLINE_API_URL": dmponline_url + "api/v1/",
+        "DMPONLINE_API_URL_V0": dmponline_url + "api/v0/",
+        "DMPONLINE_USER": "loadtest@example.com",
+        "DMPONLINE_AUTH_CODE": API_KEY,
+    }
+
+
+def main():
+    # Input params
+    parser = ArgumentParser(description="Fake SweCRIS and DMPonline servers for testing.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--swecris-port", type=int, default=8801, help="Port of the fake SweCRIS API")
+    parser.add_argument("--dmponline-port", type=int, default=8802, help="Port of the fake DMPonline API")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds added at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second per server before "
+                                                                       "answering 429 (0 for no limit)")
+    parser.add_argument("--projects", type=int, default=1000, help="Number of projects of the organisation")
+    parser.add_argument("--templates", type=int, default=250, help="Number of templates")
+    parser.add_argument("--plans", type=int, default=1000, help="Number of existing plans")
+    parser.add_argument("--max-per-page", type=int, default=100, help="Largest page size the listings allow")
+    args = parser.parse_args()
+
+    settings = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    rate_limit=args.rate_limit, projects=args.projects, templates=args.templates,
+                    plans=args.plans, max_per_page=args.max_per_page)
+    swecris, swecris_url = start(FakeState(**settings), args.swecris_port)
+    dmponline, dmponline_url = start(FakeState(**settings), args.dmponline_port)
+    print("Fake servers running, use these settings in .env:")
+    for name, value in env_settings(swecris_url, dmponline_url).items():
+        print(name + "=" + value)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        swecris.shutdown()
+        dmponline.shutdown()
+
+
+if __name__ == "__main__":
+    main()
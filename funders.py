@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+from functools import lru_cache
+
+# Registry of the funders the scripts know, read from funders.json next to this file
+# (or the file set as FUNDERS_FILE in .env). Every funder has the acronym used with -f,
+# the suffix SweCRIS adds to its grant ids (2021-04241_VR), its ROR and the SweCRIS
+# fundingOrganisationId. The registry is indexed on all four, so a lookup in any
+# direction is a dict lookup. A new funder only needs a new entry in the file.
+# Usage: funder = funders.get("vr"); funders.by_suffix("_VR")["ror"]
+
+FUNDERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "funders.json")
+FIELDS = ("acronym", "suffix", "ror", "organisation_id")
+
+
+@lru_cache(maxsize=None)
+def registry(path=None):
+    # {field: {value: funder}} for every field in FIELDS, loaded once
+    path = path or os.getenv("FUNDERS_FILE") or FUNDERS_FILE
+    with open(path, encoding="utf-8") as funders_file:
+        entries = json.load(funders_file)
+    indexes = {field: {} for field in FIELDS}
+    for funder in entries:
+        for field in FIELDS:
+            if funder.get(field):
+                indexes[field][_key(field, funder[field])] = funder
+    return indexes
+
+
+def _key(field, value):
+    # Acronyms are matched case-insensitively, SweCRIS suffixes as given
+    if field == "acronym":
+        return value.strip().lower()
+    if field == "ror":
+        # https://ror.org/03zttf063 or 03zttf063, the same way find_organisation_id matches it
+        return value.strip().rstrip("/").rsplit("/", 1)[-1].lower()
+    return value.strip()
+
+
+def _lookup(field, value):
+    if not value:
+        return None
+    return registry()[field].get(_key(field, value))
+
+
+def get(acronym):
+    # The funder for an acronym (vr, formas, ...), None if unknown
+    return _lookup("acronym", acronym)
+
+
+def by_suffix(suffix):
+    return _lookup("suffix", suffix)
+
+
+def by_ror(ror):
+    return _lookup("ror", ror)
+
+
+def by_organisation(organisation_id):
+    # The funder for a SweCRIS fundingOrganisationId
+    return _lookup("organisation_id", organisation_id)
+
+
+def acronyms():
+    return list(registry()["acronym"])
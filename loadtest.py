@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import fake_servers
+
+# Simple script that load tests the bulk paths of the scripts against the fake servers in
+# fake_servers.py: creating plans from SweCRIS grants (as swecris_to_dmponline.py -b does),
+# downloading plans (as dmponline2_file_v1.py does) and harvesting templates. Every HTTP
+# request is timed, and each scenario reports operations/s, requests/s and latency percentiles,
+# so changes to concurrency, pooling and caching can be measured the same way every time.
+# All files (caches, ledger, downloads) go to a temporary folder, never to the real ones, and
+# the folder is removed after the run (--keep keeps it).
+# The startup scenario (not run by default) times how long dmp.py and the scripts take to start.
+# Example: ./python3 loadtest.py create download -n 500 -w 16 --latency 0.05
+# Against servers started separately: ./python3 fake_servers.py & ./python3 loadtest.py --swecris-url http://127.0.0.1:8801/ --dmponline-url http://127.0.0.1:8802/
+
+SCENARIOS = ["create", "download", "templates"]
+STARTUP_COMMANDS = [
+    ["dmp.py", "--help"],
+    ["dmp.py", "create", "--help"],
+    ["dmp.py", "sync", "--help"],
+    ["dmp.py", "export", "--help"],
+    ["dmp.py", "--complete", "download"],
+    ["swecris_to_dmponline.py", "--help"],
+    ["dmponline2_file_v1.py", "--help"],
+]
+
+# Run once more for the dmp.py commands: prints the modules of NOT_LOADED that were loaded.
+# dmp.py puts the modules it defers in sys.modules as lazy modules, which only become plain
+# modules once they are used.
+NOT_LOADED = ["requests", "urllib3"]
+LOADED_CHECK = (
+    "import os, runpy, sys, types\n"
+    "sys.argv = sys.argv[1:]\n"
+    "sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))\n"
+    "try:\n"
+    "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "sys.stderr.write('loaded: ' + ' '.join(name for name in " + repr(NOT_LOADED) +
+    " if type(sys.modules.get(name)) is types.ModuleType) + '\\n')\n"
+)
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+class Recorder:
+    # Collects (seconds, status) of every request made through dmp_http
+
+    def __init__(self):
+        self.samples = []
+
+    def __call__(self, method, url, status_code, seconds):
+        self.samples.append((seconds, status_code))  # list.append is thread safe
+
+    def reset(self):
+        self.samples = []
+
+
+def run_create(args):
+    import madmp
+    import run_pipeline
+    import swecris_to_dmponline
+
+    grants = [{"grantid": fake_servers.project_id(n).rsplit("_", 1)[0],
+               "funder": "auto" if args.auto_funder else madmp.funder_of(fake_servers.project_id(n)), "name": "Load Test",
+               "email": "loadtest" + str(n) + "@example.com", "template": "1", "lang": "eng", "orcid": ""}
+              for n in range(args.number)]
+
+    # The same pipeline as in batch mode, -w threads for the SweCRIS fetches and for the uploads
+    stages = swecris_to_dmponline.create_stages(use_cache=not args.no_cache, validate=args.validate,
+                                                workers={"fetch": args.workers, "upload": args.workers})
+    statuses = []
+    run_pipeline.run(({"grant": grant} for grant in grants), stages, lambda unit: statuses.append(unit["status"]))
+    return len(statuses), statuses.count("created")
+
+
+def run_download(args):
+    import dmponline_plans
+
+    planids = [str(n) for n in range(1, args.number + 1)]
+    failed = dmponline_plans.download_plans(planids, dmponline_plans.download_plan_v1, concurrency=args.workers,
+                                            report=lambda planid, path, error: None)
+    return len(planids), len(planids) - len(failed)
+
+
+def run_templates(args):
+    import dmponline_pages
+
+    items = list(dmponline_pages.iter_items("templates", workers=args.workers))
+    return len(items), len(items)
+
+
+def run_startup(args):
+    # Starts each command -n times (at most 50) in a new interpreter, prints min and median.
+    # Returns the dmp.py commands that loaded a module of NOT_LOADED.
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = max(1, min(args.number, 50))
+    failed = []
+    for command in STARTUP_COMMANDS:
+        times = []
+        for run in range(runs):
+            started = time.monotonic()
+            subprocess.run([sys.executable, os.path.join(here, command[0])] + command[1:],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+            times.append(time.monotonic() - started)
+        times.sort()
+        loaded = ""
+        if command[0] == "dmp.py":
+            output = subprocess.run([sys.executable, "-c", LOADED_CHECK, os.path.join(here, command[0])] + command[1:],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False).stderr
+            names = [line[len("loaded:"):].strip() for line in output.splitlines() if line.startswith("loaded:")]
+            if not names or names[-1]:
+                loaded = ", LOADS " + names[-1] if names else ", check failed"
+                failed.append(" ".join(command))
+            else:
+                loaded = ", requests not loaded"
+        print("  " + " ".join(command).ljust(40) + " min " + "%.1f" % (times[0] * 1000) + " ms, median " +
+              "%.1f" % (percentile(times, 0.5) * 1000) + " ms" + loaded)
+    return failed
+
+
+def report(name, operations, succeeded, seconds, samples):
+    latencies = sorted(sample[0] for sample in samples)
+    statuses = {}
+    for latency, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    print(name + ": " + str(succeeded) + "/" + str(operations) + " ok in " + "%.2f" % seconds + " s, " +
+          "%.1f" % (operations / seconds) + " operations/s")
+    print("  " + str(len(samples)) + " requests, " + "%.1f" % (len(samples) / seconds) + " requests/s, latency ms " +
+          " ".join(label + " " + "%.1f" % (percentile(latencies, fraction) * 1000)
+                   for label, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))))
+    print("  status codes: " + ", ".join(status + ": " + str(count) for status, count in sorted(statuses.items())))
+
+
+def run_scenarios(args, workdir, swecris_url, dmponline_url):
+    # Runs the scenarios of args with workdir as the current directory, returns the commands
+    # of the startup scenario that loaded too much
+    # Settings have to be in place before the scripts are imported, they read .env on import
+    # and the values set here take precedence over it
+    os.environ.update(fake_servers.env_settings(swecris_url, dmponline_url))
+    os.environ.update({
+        "HTTP_RATE": str(args.rate),
+        "HTTP_POOL_SIZE": os.getenv("HTTP_POOL_SIZE") or str(max(args.workers, 10)),
+        "TOKEN_CACHE": os.path.join(workdir, "tokens.json"),
+        "SWECRIS_CACHE": os.path.join(workdir, "swecris_cache.sqlite"),
+        "LOGFILE": os.path.join(workdir, "dmplog.txt"),
+    })
+    os.chdir(workdir)
+    import dmp_http
+
+    print("SweCRIS: " + swecris_url + "  DMPonline: " + dmponline_url + "  files: " + workdir)
+    recorder = Recorder()
+    dmp_http.add_observer(recorder)
+    runners = {"create": run_create, "download": run_download, "templates": run_templates}
+    slow_starts = []
+    for name in args.scenarios:
+        if name == "startup":
+            print("startup:")
+            slow_starts = run_startup(args)
+            continue
+        for run in range(1, args.repeat + 1):
+            recorder.reset()
+            started = time.monotonic()
+            operations, succeeded = runners[name](args)
+            seconds = time.monotonic() - started
+            report(name + (" (run " + str(run) + ")" if args.repeat > 1 else ""), operations, succeeded,
+                   seconds, recorder.samples)
+    return slow_starts
+
+
+def main():
+    # Input params
+    parser = ArgumentParser(description="Load test the bulk create and download paths against fake servers.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help="Scenarios to run: " + ", ".join(SCENARIOS) + " (default all)")
+    parser.add_argument("-n", "--number", type=int, default=200, help="Plans to create/download per scenario")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Concurrent grants, downloads or pages")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Run each scenario this many times "
+                                                                     "(later runs use the warm caches)")
+    parser.add_argument("--rate", type=float, default=1000, help="HTTP_RATE used by the scripts (requests/s per host)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the SweCRIS cache")
+    parser.add_argument("--validate", action="store_true", help="Validate the maDMP records before upload")
+    parser.add_argument("--auto-funder", action="store_true", help="Create with funder auto, detecting the funder of each grant")
+    parser.add_argument("--swecris-url", default="", help="Use a fake SweCRIS server started separately")
+    parser.add_argument("--dmponline-url", default="", help="Use a fake DMPonline server started separately")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latency of the fake servers started here")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Random extra latency of the fake servers")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 500 answers from the fake servers")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests/s the fake servers accept before 429")
+    parser.add_argument("--keep", action="store_true", help="Keep the directory with the files of the run, it is removed otherwise")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS + ["startup"]]
+    if unknown:
+        parser.error("unknown scenario: " + ", ".join(unknown))
+    args.scenarios = args.scenarios or SCENARIOS
+
+    settings = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    rate_limit=args.rate_limit, plans=max(args.number, 1000))
+    swecris_url = args.swecris_url or fake_servers.start(fake_servers.FakeState(**settings))[1]
+    dmponline_url = args.dmponline_url or fake_servers.start(fake_servers.FakeState(**settings))[1]
+
+    if args.keep:
+        slow_starts = run_scenarios(args, tempfile.mkdtemp(prefix="dmp-loadtest-"), swecris_url, dmponline_url)
+    else:
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory(prefix="dmp-loadtest-") as workdir:
+            try:
+                slow_starts = run_scenarios(args, workdir, swecris_url, dmponline_url)
+            finally:
+                os.chdir(cwd)
+    if slow_starts:
+        sys.stderr.write("These commands load " + " or ".join(NOT_LOADED) + " at startup: " + ", ".join(slow_starts) + "\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
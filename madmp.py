@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import funders
+
+# Mapping from a SweCRIS project to an RDA maDMP record (RDA DMP Common Standard 1.0),
+# as used when creating plans in DMPonline. Kept free of network code so it can be
+# imported by the scripts and by the offline transform in swecris_jsonl_to_madmp.py.
+
+# Parts of a record that come from SweCRIS and can change after the plan was created
+# (the funding is part of the project), see source_hash()
+SOURCE_FIELDS = ("project", "contributor")
+
+
+def funder_params(grantid, funder):
+    # Create Swecris ID and funder ROR for a grant, (None, None) for unknown funders (see funders.py)
+    entry = funders.get(funder)
+    if entry is None:
+        return None, None
+    return grantid + entry["suffix"], entry["ror"]
+
+
+def funder_of(swecrisid):
+    # Funder acronym from the suffix of a SweCRIS id (2021-04241_VR -> vr), None if unknown
+    if "_" not in swecrisid:
+        return None
+    entry = funders.by_suffix("_" + swecrisid.rsplit("_", 1)[1])
+    return entry["acronym"] if entry else None
+
+
+def project_title(swecrisdata, lang):
+    if lang == "swe":
+        return swecrisdata["projectTitleSv"]
+    return swecrisdata["projectTitleEn"]
+
+
+def swecris_to_madmp(swecrisdata, swecrisid, funder, funder_ror, lang, contact_name, contact_email, templateid,
+                     affiliation=None, affiliation_abbrev=None):
+    # RDA maDMP record ({"dmp": {...}}) for a SweCRIS project
+    if affiliation is None:
+        affiliation = os.getenv("DEFAULT_AFF")
+    if affiliation_abbrev is None:
+        affiliation_abbrev = os.getenv("DEFAULT_AFF_ABBREV")
+
+    project_desc = swecrisdata["projectAbstractEn"]
+    if lang == "swe":
+        project_desc = swecrisdata["projectAbstractSv"]
+    if project_desc == "":
+        project_desc = "(missing)"
+        if lang == "swe":
+            project_desc = "(saknas)"
+    # SweCRIS gives "2021-01-01 00:00:00", the standard a date
+    project_start = (swecrisdata["projectStartDate"] or "")[:10] or None  # replaced fundingStartDate
+    project_end = (swecrisdata["projectEndDate"] or "")[:10] or None  # replaced fundingEndDate
+
+    # Create maDMP
+    dmp = {}
+    madmp_schema = (
+        "https://github.com/RDA-DMP-Common/RDA-DMP-Common-Standard/tree/master/examples/JSON/JSON"
+        "-schema/1.0"
+    )  # will be changed by DMPonline nonetheless.
+
+    d = dict()
+
+    # Basic data
+    d["schema"] = madmp_schema
+    created_at = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    d["title"] = project_title(swecrisdata, lang)  # actually project tile
+    d["description"] = project_desc  # actually project description
+    d["language"] = lang
+    d["created"] = created_at
+    d["ethical_issues_exist"] = "unknown"
+
+    # Contact person
+    # This is handled by the script params. Please note that if the user exists in DMPonline, DMPonline will add information to the system.
+    # At the moment Orcid is problematic and thus commented out.
+    # Contact
+    cnt = {
+        "name": contact_name,
+        "mbox": contact_email,
+        "affiliation": {"name": affiliation, "abbreviation": affiliation_abbrev},
+    }
+    # if contact_orcid:
+    #    cnt["contact_id"] = {"identifier": "https://orcid.org/" + contact_orcid, "type": "orcid"}
+    d["contact"] = cnt
+
+    # Contributors
+    cs = []
+    for persons in swecrisdata["peopleList"]:
+        ct = {}
+        ct["name"] = persons['fullName']
+        # Role
+        ct["role"] = ["other"]  # uneditable and not considered, but can be included
+        if lang == "swe":
+            ct["role"] = ["other"]
+        ct["affiliation"] = {
+            "name": affiliation,
+            "abbreviation": affiliation_abbrev,
+        }
+        # Orcid - this is currently to problematic to use
+        # if "orcId" in persons:
+        #    orcid = "https://orcid.org/" + persons['orcId']
+        # ct["contributor_id"] = {"identifier": orcid, "type": "orcid"}   #MASSIVE HEADACHE keeps changing to some default orcid.
+        cs.append(ct)
+
+    d["contributor"] = cs
+
+    # Project info
+    ps = []
+    pt = {
+        "title": d["title"],
+        "description": project_desc,
+        "start": project_start,
+        "end": project_end,
+    }
+    # Funder
+    pfl = []
+    pfn = {
+        "name": funder,
+        "funder_id": {"type": "ror", "identifier": funder_ror}, # keeps getting changed to "https://ror.org/123abc45y" cannot figure out why.
+        "grant_id": {"identifier": swecrisid, "type": "other"},
+        "funding_status": "granted",
+    }  # Please note that grantIDs need to be unique. if they already exist then the field will become blank.
+    pfl.append(pfn)
+    pt["funding"] = pfl
+    ps.append(pt)
+    d["project"] = ps
+
+    # Dataset (dummy, standard compliance)
+    dsts_empty = []
+    dset_empty = {
+        "type": "dataset",
+        "title": "Generic dataset",
+        "description": "No individual datasets have been defined for this DMP.",
+        "personal_data": "unknown",
+        "sensitive_data": "unknown",
+    }
+    dsts_empty.append(dset_empty)
+    d["dataset"] = dsts_empty
+
+    # DMP template
+    extension = [
+        {
+            "dmproadmap": {
+                "template": {
+                    "id": templateid,
+                    "title": "",
+                }
+            }
+        }
+    ]
+
+    d["extension"] = extension
+
+    # Create maDMP record
+    dmp["dmp"] = d
+    return dmp
+
+
+def source_hash(record):
+    # Content hash of the SweCRIS derived parts of a record ({"dmp": {...}} or the plans API
+    # wrapper), independent of key order, for telling whether a plan needs an update
+    if "items" in record:
+        record = record["items"][0]
+    dmp = record["dmp"]
+    source = {field: dmp.get(field) for field in SOURCE_FIELDS}
+    text = json.dumps(source, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
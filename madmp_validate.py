@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import copy
+import hashlib
+import json
+import os
+import re
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import date, datetime
+from functools import lru_cache
+
+# Validation of generated maDMP records against the RDA DMP Common Standard JSON schema,
+# before anything is sent to DMPonline. The schema (maDMP-schema-1.0.json) is kept next to
+# this file, and the compiled validator is cached per process, so validating a batch
+# only costs the validation itself.
+# Identifiers and timestamps that DMPonline assigns when a plan is created (dmp_id,
+# modified, contact_id, contributor_id, dataset_id) are not required here, and funders may
+# be given by their ROR id, as DMPonline does.
+# The formats of the schema (date, date-time, email) are checked here and not by the
+# optional packages jsonschema uses when they are installed, so a record is valid or
+# invalid in every environment. uri is not checked.
+# The schema file has to be the published one byte for byte: --check-schema compares its SHA-256
+# with the copy on GitHub and --update-schema replaces it with that copy.
+# Usage: errors = madmp_validate.validate(record)  (empty list if the record is valid)
+# Example: ./python3 madmp_validate.py --check-schema
+#
+# Optional settings in .env:
+# MADMP_SCHEMA   path of another schema file (default: maDMP-schema-1.0.json next to this file)
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maDMP-schema-1.0.json")
+SCHEMA_URL = ("https://raw.githubusercontent.com/RDA-DMP-Common/RDA-DMP-Common-Standard/master/"
+              "examples/JSON/JSON-schema/1.0/maDMP-schema-1.0.json")
+
+# (path in the record, fields DMPonline fills in itself)
+SERVER_ASSIGNED = [
+    (("dmp",), ["dmp_id", "modified"]),
+    (("dmp", "contact"), ["contact_id"]),
+    (("dmp", "contributor"), ["contributor_id"]),
+    (("dmp", "dataset"), ["dataset_id"]),
+]
+# (path in the record, identifier types DMPonline takes besides those of the schema)
+EXTRA_TYPES = [
+    (("dmp", "project", "funding", "funder_id"), ["ror"]),
+]
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DATE_TIME = re.compile(r"^\d{4}-\d{2}-\d{2}[Tt]\d{2}:\d{2}:\d{2}(\.\d+)?([Zz]|[+-]\d{2}:\d{2})$")
+
+
+class SchemaError(Exception):
+    pass
+
+
+def schema_source():
+    return os.getenv("MADMP_SCHEMA") or SCHEMA_FILE
+
+
+def load_schema(source=None):
+    source = source or schema_source()
+    try:
+        with open(source, encoding="utf-8") as schema_file:
+            return json.load(schema_file)
+    except (OSError, ValueError) as e:
+        raise SchemaError("Could not read the maDMP schema " + source + ": " + str(e))
+
+
+def is_date(value):
+    # YYYY-MM-DD, a real date
+    if not isinstance(value, str):
+        return True
+    return bool(_DATE.match(value)) and date.fromisoformat(value) is not None
+
+
+def is_date_time(value):
+    # RFC 3339 timestamp with time zone, e.g. 2024-05-01T12:00:00Z
+    if not isinstance(value, str):
+        return True
+    return bool(_DATE_TIME.match(value)) and datetime.fromisoformat(value.upper().replace("Z", "+00:00")) is not None
+
+
+def is_email(value):
+    return not isinstance(value, str) or "@" in value
+
+
+def _subschema(schema, path):
+    node = schema
+    for name in path:
+        node = (node.get("properties") or {}).get(name)
+        if node is None:
+            return None
+        if node.get("type") == "array" and isinstance(node.get("items"), dict):
+            node = node["items"]
+    return node
+
+
+def relax(schema):
+    # Copy of the schema where the fields assigned by DMPonline are optional and the
+    # identifier types DMPonline takes are allowed
+    schema = copy.deepcopy(schema)
+    for path, fields in SERVER_ASSIGNED:
+        node = _subschema(schema, path)
+        if node is not None and "required" in node:
+            node["required"] = [name for name in node["required"] if name not in fields]
+    for path, types in EXTRA_TYPES:
+        node = _subschema(schema, path + ("type",))
+        if node is not None and "enum" in node:
+            node["enum"] = node["enum"] + [value for value in types if value not in node["enum"]]
+    return schema
+
+
+def format_checker():
+    # Only the checks defined here, whatever optional packages are installed
+    import jsonschema
+
+    checker = jsonschema.FormatChecker(formats=())
+    checker.checks("date", raises=ValueError)(is_date)
+    checker.checks("date-time", raises=ValueError)(is_date_time)
+    checker.checks("email")(is_email)
+    return checker
+
+
+@lru_cache(maxsize=None)
+def get_validator(source=None):
+    # Compiled once per process and schema
+    import jsonschema
+
+    schema = relax(load_schema(source))
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema, format_checker=format_checker())
+
+
+def validate(record, source=None):
+    # Errors for one maDMP record ({"dmp": {...}}) or a plans POST body ({"items": [...]})
+    if "items" in record and "dmp" not in record:
+        errors = []
+        for item in record["items"]:
+            errors.extend(validate(item, source))
+        return errors
+    validator = get_validator(source)
+    return [
+        ("/".join(str(part) for part in error.absolute_path) or "(record)") + ": " + error.message
+        for error in sorted(validator.iter_errors(record), key=lambda error: list(error.absolute_path))
+    ]
+
+
+def sha256_of(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def published_schema():
+    # The published schema file as bytes
+    import dmp_http
+
+    try:
+        response = dmp_http.get(SCHEMA_URL)
+        dmp_http.raise_for_status(response)
+    except Exception as e:
+        raise SchemaError("Could not download the maDMP schema from " + SCHEMA_URL + ": " + str(e))
+    return response.content
+
+
+def check_schema(path=SCHEMA_FILE):
+    # (SHA-256 of the schema file, SHA-256 of the published copy)
+    with open(path, "rb") as schema_file:
+        local = sha256_of(schema_file.read())
+    return local, sha256_of(published_schema())
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Check the bundled maDMP schema against the published RDA DMP Common "
+                                        "Standard 1.0 schema.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--check-schema", action="store_true",
+                        help="Compare the SHA-256 of " + os.path.basename(SCHEMA_FILE) + " with the published copy")
+    action.add_argument("--update-schema", action="store_true",
+                        help="Replace " + os.path.basename(SCHEMA_FILE) + " with the published copy")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        if args.update_schema:
+            data = published_schema()
+            with open(SCHEMA_FILE, "wb") as schema_file:
+                schema_file.write(data)
+            print("Stored the published schema as " + SCHEMA_FILE + ", SHA-256 " + sha256_of(data))
+            return
+        local, published = check_schema()
+    except (OSError, SchemaError) as e:
+        print("Schema check failed! " + str(e))
+        sys.exit(1)
+    print("SHA-256 of " + SCHEMA_FILE + ": " + local)
+    print("SHA-256 of " + SCHEMA_URL + ": " + published)
+    if local != published:
+        print("The schema file is not the published one, run with --update-schema.")
+        sys.exit(1)
+    print("The schema file is the published one.")
+
+
+if __name__ == "__main__":
+    main()
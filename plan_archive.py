@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import dmp_files
+
+# Content-addressed archive of every version of the downloaded plans, in Plan_archive.
+# A plan answer is hashed and gzip compressed chunk by chunk while it streams in, and stored
+# once as a blob named after the SHA-256 of its content
+# (Plan_archive/blobs/ab/abcdef....json.gz). The index (Plan_archive/index.sqlite) records
+# when a plan id and API version got which blob. Fetching a plan that did not change keeps
+# nothing, a changed plan adds one compressed blob and one index row, so the history of all
+# plans costs little space. Used by dmponline_plans.py for every download, which writes the
+# plan file from the blob with extract().
+# Example: ./python3 plan_archive.py history 135516
+#          ./python3 plan_archive.py show 135516 --api V0 --at 2024-06-01
+
+ARCHIVE_DIR = "Plan_archive"
+COMPRESS_LEVEL = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    planid TEXT NOT NULL,
+    version TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    size INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS snapshots_plan ON snapshots (planid, version, fetched_at);
+"""
+
+
+def _connection(directory=ARCHIVE_DIR):
+    return dmp_files.sqlite_connection(os.path.join(directory, "index.sqlite"), SCHEMA)
+
+
+def blob_path(digest, directory=ARCHIVE_DIR):
+    return os.path.join(directory, "blobs", digest[:2], digest + ".json.gz")
+
+
+def latest(planid, version, directory=ARCHIVE_DIR):
+    # Blob of the newest snapshot of a plan, or None
+    row = _connection(directory).execute(
+        "SELECT blob FROM snapshots WHERE planid = ? AND version = ? ORDER BY fetched_at DESC, rowid DESC LIMIT 1",
+        (planid, version),
+    ).fetchone()
+    return row[0] if row else None
+
+
+class BlobWriter:
+    # Text file object that hashes and compresses what is written to it, chunk by chunk,
+    # into a temporary blob file. commit() then files it under its hash, discard() drops it.
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        descriptor, self.tmp_path = tempfile.mkstemp(dir=os.path.join(directory, "blobs"), suffix=".tmp")
+        self.file = os.fdopen(descriptor, "wb")
+        self.gzip = gzip.GzipFile(filename="", mode="wb", compresslevel=COMPRESS_LEVEL, fileobj=self.file, mtime=0)
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.hash.update(data)
+        self.gzip.write(data)
+        self.size += len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        if not self.file.closed:
+            self.gzip.close()
+            self.file.close()
+        return self.hash.hexdigest()
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def commit(planid, version, blob):
+    # Archives the plan answer written to blob (a BlobWriter). Returns True if it differs from
+    # the newest snapshot, else the blob is dropped.
+    digest = blob.close()
+    directory = blob.directory
+    if latest(planid, version, directory) == digest:
+        blob.discard()
+        return False
+    path = blob_path(digest, directory)
+    if os.path.exists(path):
+        blob.discard()
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(blob.tmp_path, path)
+    db = _connection(directory)
+    with db:
+        db.execute("INSERT INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                   (planid, version, time.strftime("%Y-%m-%dT%H:%M:%S"), digest, blob.size))
+    return True
+
+
+def add(planid, version, text, directory=ARCHIVE_DIR):
+    # Archives a plan answer given as a whole text, see commit()
+    blob = BlobWriter(directory)
+    blob.write(text)
+    return commit(planid, version, blob)
+
+
+def extract(digest, path, directory=ARCHIVE_DIR):
+    # Writes an archived plan answer uncompressed to path, under a temporary name first
+    tmp_path = path + ".tmp"
+    try:
+        with gzip.open(blob_path(digest, directory), "rb") as blob_file, open(tmp_path, "wb") as out_file:
+            shutil.copyfileobj(blob_file, out_file, 64 * 1024)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def history(planid, version=None, directory=ARCHIVE_DIR):
+    # (version, fetched_at, blob, size) of every snapshot of a plan, oldest first
+    query = "SELECT version, fetched_at, blob, size FROM snapshots WHERE planid = ?"
+    params = [planid]
+    if version:
+        query += " AND version = ?"
+        params.append(version)
+    return _connection(directory).execute(query + " ORDER BY fetched_at, rowid", params).fetchall()
+
+
+def read(digest, directory=ARCHIVE_DIR):
+    # The archived plan answer as text
+    with gzip.open(blob_path(digest, directory), "rt", encoding="utf-8") as blob_file:
+        return blob_file.read()
+
+
+def snapshot_at(planid, version, when=None, directory=ARCHIVE_DIR):
+    # Blob of the snapshot a plan had at a time (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS), newest if None
+    if when is None:
+        return latest(planid, version, directory)
+    if len(when) == 10:
+        when += "T23:59:59"
+    row = _connection(directory).execute(
+        "SELECT blob FROM snapshots WHERE planid = ? AND version = ? AND fetched_at <= ?"
+        " ORDER BY fetched_at DESC, rowid DESC LIMIT 1",
+        (planid, version, when),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def stats(directory=ARCHIVE_DIR):
+    # (plans, snapshots, bytes fetched, bytes stored)
+    db = _connection(directory)
+    plans, snapshots, fetched = db.execute(
+        "SELECT COUNT(DISTINCT planid || ' ' || version), COUNT(*), COALESCE(SUM(size), 0) FROM snapshots"
+    ).fetchone()
+    stored = 0
+    for digest, in db.execute("SELECT DISTINCT blob FROM snapshots"):
+        try:
+            stored += os.path.getsize(blob_path(digest, directory))
+        except OSError:
+            pass
+    return plans, snapshots, fetched, stored
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Look into the archive of downloaded plans.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("action", choices=["history", "show", "stats"],
+                        help="history: snapshots of a plan, show: print a snapshot, stats: size of the archive")
+    parser.add_argument("planid", nargs="?", default="", help="DMPonline plan id (history and show)")
+    parser.add_argument("--api", default="V1", choices=["V0", "V1", "V0V1"],
+                        help="API version of the snapshot to show, V0V1 for the combined files of dmponline2_file.py")
+    parser.add_argument("--at", default=None, help="Show the snapshot the plan had at this date (YYYY-MM-DD)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.action != "stats" and not args.planid:
+        parser.error("a plan id is needed for " + args.action)
+
+    if args.action == "stats":
+        plans, snapshots, fetched, stored = stats()
+        print(str(plans) + " plans, " + str(snapshots) + " snapshots, " + str(fetched // 1024) + " kB as fetched, " +
+              str(stored // 1024) + " kB stored")
+    elif args.action == "history":
+        snapshots = history(args.planid)
+        if not snapshots:
+            print("Plan " + args.planid + " is not in the archive.")
+        for version, fetched_at, digest, size in snapshots:
+            print(fetched_at + "  " + version + "  " + digest[:12] + "  " + str(size) + " bytes")
+    else:
+        digest = snapshot_at(args.planid, args.api, args.at)
+        if digest is None:
+            print("No snapshot of plan " + args.planid + " (" + args.api + ") in the archive.")
+            exit()
+        sys.stdout.write(read(digest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import html
+import os
+import re
+import sqlite3
+import sys
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import dmp_files
+import dmponline_export
+
+# Simple script for full-text search in the plans in Downloaded_plans. Titles, descriptions,
+# projects and datasets of the API V1 files and the answers of the API V0 files are put in
+# an SQLite FTS5 index (Downloaded_plans/.search_index.sqlite), so a search takes milliseconds
+# however many plans there are. The index is updated incrementally: only files that are new
+# or changed since the last update are read again (in a pool of processes), removed files are
+# dropped. A query brings the index up to date first, which costs one directory listing when
+# nothing changed.
+# Example: ./python3 plan_search.py query '"sensitive personal data"'
+#          ./python3 plan_search.py query 'zenodo OR figshare' -n 50
+#          ./python3 plan_search.py index --full
+
+INDEX_FILE = dmp_files.SEARCH_INDEX_FILE
+_TAG = re.compile(r"<[^>]+>")
+
+# table of dmponline_export.py: (columns naming the part, columns with the text)
+SEARCHED = {
+    "plans": (["api"], ["title", "description"]),
+    "projects": (["project"], ["title", "description"]),
+    "datasets": (["dataset"], ["title", "description"]),
+    "answers": (["section", "question"], ["question_text", "answer"]),
+}
+
+
+def _plain(text):
+    # Text without HTML tags and entities (the v0 answers are HTML)
+    return " ".join(html.unescape(_TAG.sub(" ", text)).split())
+
+
+def parts_of(path):
+    # (file name, [(plan id, API version, part, text)], error) for a plan file, run in the worker processes
+    name, rows, error = dmponline_export.flatten_file(path)
+    if error is not None:
+        return name, None, error
+    version = dmponline_export.FILE_PATTERN.match(name).group(2)
+    parts = []
+    for table, (label_columns, text_columns) in SEARCHED.items():
+        columns = dmponline_export.TABLES[table]
+        for row in rows[table]:
+            values = dict(zip(columns, row))
+            texts = [_plain(values[column]) for column in text_columns if values[column]]
+            if texts:
+                label = table[:-1] + " " + " ".join(str(values[column]) for column in label_columns
+                                                     if values[column] is not None)
+                parts.append((values["plan_id"], version, label.strip(), "\n".join(texts)))
+    return name, parts, None
+
+
+def connect(path=INDEX_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path)
+    db.executescript(
+        "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER);"
+        "CREATE TABLE IF NOT EXISTS parts (id INTEGER PRIMARY KEY, source TEXT NOT NULL, plan_id TEXT,"
+        " api TEXT, part TEXT, body TEXT);"
+        "CREATE INDEX IF NOT EXISTS parts_source ON parts (source);"
+        # External content FTS5 table over parts, kept in step by the triggers
+        "CREATE VIRTUAL TABLE IF NOT EXISTS parts_fts USING fts5(body, content='parts', content_rowid='id',"
+        " tokenize='unicode61 remove_diacritics 2');"
+        "CREATE TRIGGER IF NOT EXISTS parts_insert AFTER INSERT ON parts BEGIN"
+        " INSERT INTO parts_fts (rowid, body) VALUES (new.id, new.body); END;"
+        "CREATE TRIGGER IF NOT EXISTS parts_delete AFTER DELETE ON parts BEGIN"
+        " INSERT INTO parts_fts (parts_fts, rowid, body) VALUES ('delete', old.id, old.body); END;"
+    )
+    return db
+
+
+def update(db, directory=dmp_files.DOWNLOAD_DIR, processes=1, full=False):
+    # Brings the index up to date with directory. Returns (indexed, removed, errors)
+
+    def store(name, parts):
+        db.execute("DELETE FROM parts WHERE source = ?", (name,))
+        if parts:
+            db.executemany("INSERT INTO parts (source, plan_id, api, part, body) VALUES (?, ?, ?, ?, ?)",
+                           [(name,) + part for part in parts])
+
+    return dmponline_export.update_files(db, directory, parts_of, store, processes, full)
+
+
+def search(db, query, limit=20):
+    # (plan id, API version, part, snippet) of the best matching parts, best first. The query
+    # uses the FTS5 syntax: words, "a phrase", OR, NOT, prefix*
+    return db.execute(
+        "SELECT parts.plan_id, parts.api, parts.part, snippet(parts_fts, 0, '[', ']', '...', 16)"
+        " FROM parts_fts JOIN parts ON parts.id = parts_fts.rowid"
+        " WHERE parts_fts MATCH ? ORDER BY rank LIMIT ?",
+        (query, limit),
+    ).fetchall()
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Full-text search in the downloaded plans.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("action", choices=["index", "query"], help="index: update the index, query: search")
+    parser.add_argument("query", nargs="?", default="", help='Search terms, e.g. "sensitive personal data" '
+                                                             '(FTS5 syntax: phrases in quotes, OR, NOT, prefix*)')
+    parser.add_argument("-n", "--limit", type=int, default=20, help="Number of results")
+    parser.add_argument("-p", "--processes", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes reading plan files")
+    parser.add_argument("-i", "--input", default=dmp_files.DOWNLOAD_DIR, help="Folder with the downloaded plans")
+    parser.add_argument("--full", action="store_true", help="Index every file again, not only the changed ones")
+    parser.add_argument("--no-update", action="store_true", help="Query the index as it is, without updating it")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.action == "query" and not args.query:
+        parser.error("no search terms given")
+
+    db = connect(os.path.join(args.input, os.path.basename(INDEX_FILE)))
+    if args.action == "index" or not args.no_update:
+        started = time.monotonic()
+        indexed, removed, errors = update(db, args.input, args.processes, args.full)
+        for name, error in sorted(errors.items()):
+            sys.stderr.write("Could not read " + name + ": " + error + "\n")
+        if args.action == "index" or indexed or removed:
+            print("Indexed " + str(indexed) + " new or changed files, removed " + str(removed) + ", " +
+                  str(len(errors)) + " unreadable, in " + "%.1f" % (time.monotonic() - started) + " s.")
+    if args.action == "index":
+        return
+
+    started = time.monotonic()
+    try:
+        results = search(db, args.query, args.limit)
+    except sqlite3.OperationalError as e:
+        print("Invalid query: " + str(e))
+        exit()
+    for planid, version, part, snippet in results:
+        print(planid + " " + version + "  " + part + ": " + " ".join(snippet.split()))
+    print(str(len(results)) + " results in " + "%.1f" % ((time.monotonic() - started) * 1000) + " ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Append-only journal of the units (grants, plans, pages) a bulk run has finished, in
+# Journals/<job>.jsonl, so an interrupted run can be resumed with --resume instead of
+# being started over. Every unit gets a "started" line and then a "done" or "failed" line.
+# On resume the done units are skipped, while units that were in flight or failed are
+# queued again. Lines are flushed at once but fsync'ed in batches (every FSYNC_EVERY lines
+# or FSYNC_INTERVAL seconds), a line torn by a crash is ignored when the journal is read.
+# A run that finishes without failures removes its journal.
+# Usage: journal = run_journal.Journal("download_" + run_journal.job_key(planids), resume=True)
+
+JOURNAL_DIR = "Journals"
+FSYNC_EVERY = 50
+FSYNC_INTERVAL = 1.0  # seconds
+
+
+def job_key(values):
+    # Short stable key for the input of a job, e.g. the plan ids or the path of a batch file
+    return hashlib.sha1("\n".join(str(value) for value in values).encode("utf-8")).hexdigest()[:12]
+
+
+class Journal:
+
+    def __init__(self, job, resume=False, directory=JOURNAL_DIR):
+        self.path = os.path.join(directory, job + ".jsonl")
+        self.completed = {}  # unit -> info of the done line
+        self.failed = {}  # unit -> error of the last failed line
+        self.in_flight = set()  # started but never finished, the run died while working on them
+        if resume:
+            self._replay()
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def _replay(self):
+        try:
+            journal_file = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                    unit, state = record["unit"], record["state"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if state == "started":
+                    self.in_flight.add(unit)
+                    continue
+                self.in_flight.discard(unit)
+                if state == "done":
+                    self.completed[unit] = record.get("info")
+                    self.failed.pop(unit, None)
+                elif state == "failed":
+                    self.failed[unit] = record.get("info")
+
+    def remaining(self, units, key=str):
+        # The units that still have to be done, in their original order
+        return [unit for unit in units if key(unit) not in self.completed]
+
+    def _append(self, unit, state, info=None):
+        record = {"unit": unit, "state": state, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if info is not None:
+            record["info"] = info
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            now = time.monotonic()
+            if self.unsynced >= FSYNC_EVERY or now - self.synced_at >= FSYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+                self.synced_at = now
+
+    def start(self, unit):
+        self._append(unit, "started")
+
+    def complete(self, unit, info=None):
+        self._append(unit, "done", info)
+        with self.lock:
+            self.completed[unit] = info
+            self.failed.pop(unit, None)
+
+    def fail(self, unit, error):
+        self._append(unit, "failed", str(error))
+        with self.lock:
+            self.failed[unit] = str(error)
+
+    def close(self, finished=False):
+        # Syncs the journal, and removes it if the run finished with every unit done
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        if finished and not self.failed:
+            os.remove(self.path)
+
+    def summary(self):
+        return (str(len(self.completed)) + " done, " + str(len(self.in_flight)) + " in flight and " +
+                str(len(self.failed)) + " failed in the interrupted run")
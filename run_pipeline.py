@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import dmp_metrics
+
+# Runs the units of a bulk run (grants) through a chain of stages, each stage with its own
+# worker threads and a bounded queue in front of it. While a stage works on one unit the
+# stages before it already work on the next ones, so the SweCRIS fetch of a grant overlaps
+# the DMPonline upload of another. When a stage is slower than the ones before it, its queue
+# fills up and the earlier stages wait for room (backpressure): the run goes at the speed of
+# the slowest stage and never holds more than a few queues' worth of units.
+# A unit is a dict that the stage functions fill in. finish(unit, status, message) in any
+# stage takes the unit out of the pipeline, the last stage has to finish every unit.
+# Usage: run_pipeline.run(units, [Stage("fetch", fetch, 8), Stage("upload", upload, 2)], done)
+
+_END = object()  # no more units are coming
+
+
+class Stage:
+
+    def __init__(self, name, process, workers=1):
+        self.name = name
+        self.process = process
+        self.workers = max(1, workers)
+        self.units = 0
+        self.busy = 0.0  # seconds in process, summed over the workers
+        self.blocked = 0.0  # seconds waiting for room in the next queue
+
+    def summary(self):
+        return (self.name + ": " + str(self.units) + " units, " + str(self.workers) + " workers, busy " +
+                "%.1f" % self.busy + " s, waited " + "%.1f" % self.blocked + " s for the next stage")
+
+
+def finish(unit, status, message):
+    # Takes a unit out of the pipeline with its result
+    unit["status"] = status
+    unit["message"] = message
+
+
+def run(units, stages, done, queue_size=16, errors=(Exception,)):
+    # Feeds units through the stages and calls done(unit) in the calling thread for every
+    # finished unit, as they come. An exception in errors finishes the unit as failed.
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for stage in stages]
+    finished = queue.Queue()
+    stop = threading.Event()
+    running = [stage.workers for stage in stages]  # workers of each stage not done yet
+    lock = threading.Lock()
+
+    def put(target, item):
+        # Waits for room in target, unless the run is stopped. Returns the seconds waited.
+        started = time.monotonic()
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        return time.monotonic() - started
+
+    def feed():
+        for unit in units:
+            put(queues[0], unit)
+            if stop.is_set():
+                return
+        for _ in range(stages[0].workers):
+            put(queues[0], _END)
+
+    def work(index):
+        stage = stages[index]
+        last = index + 1 == len(stages)
+        while True:
+            unit = queues[index].get()
+            if unit is _END:
+                break
+            if stop.is_set():
+                continue
+            started = time.monotonic()
+            try:
+                stage.process(unit)
+            except errors as e:
+                finish(unit, "failed", str(e))
+            except Exception as e:
+                traceback.print_exc(file=sys.stderr)
+                finish(unit, "failed", type(e).__name__ + ": " + str(e))
+            seconds = time.monotonic() - started
+            if last and "status" not in unit:
+                finish(unit, "failed", "not finished by stage " + stage.name)
+            dmp_metrics.observe("stage_duration_seconds", seconds, stage=stage.name)
+            blocked = put(finished if "status" in unit else queues[index + 1], unit)
+            if blocked >= 0.001:
+                dmp_metrics.inc("stage_blocked_seconds", blocked, stage=stage.name)
+            with lock:
+                stage.units += 1
+                stage.busy += seconds
+                stage.blocked += blocked
+        with lock:
+            running[index] -= 1
+            last_worker = running[index] == 0
+        if last_worker:
+            # All units of this stage are passed on, so the next stage can stop after them
+            if last:
+                finished.put(_END)
+            else:
+                for _ in range(stages[index + 1].workers):
+                    put(queues[index + 1], _END)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, stage in enumerate(stages):
+        threads += [threading.Thread(target=work, args=(index,), daemon=True) for _ in range(stage.workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            unit = finished.get()
+            if unit is _END:
+                break
+            done(unit)
+    finally:
+        stop.set()
+    return stages
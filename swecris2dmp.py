@@ -10,6 +10,9 @@ from datetime import datetime
 import os
 import uuid
 
+import funders
+import swecris_cache
+
 # Simple cript for creating new DMP:s (projects) in DMP Online (or other maDMP compatible tools), using basic data
 # from SweCRIS.
 # Todo: lots of things...
@@ -31,14 +34,14 @@ parser = ArgumentParser(description="Create new DMP using data from Swecris.",
                         formatter_class=ArgumentDefaultsHelpFormatter)
 parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
 parser.add_argument("-i", "--grantid", default="", help="Grant ID, i.e. 2023-012345", required=True)
-parser.add_argument("-f", "--funder", default="vr", help="Funder acronym. Allowed values: vr, energimyndigheten, "
-                                                         "formas, forte, rj, rymdstyrelsen, vinnova",
-                    required=True)
+parser.add_argument("-f", "--funder", default="vr", help="Funder acronym. Allowed values: " +
+                                                         ", ".join(funders.acronyms()), required=True)
 parser.add_argument("-l", "--lang", default="eng", help="Language used in DMP, possible values: swe, eng",
                     required=False)
 parser.add_argument("-n", "--name", default="", help="Full name of contact person for DMP", required=True)
 parser.add_argument("-e", "--email", default="", help="Contact person e-mail", required=True)
 parser.add_argument("-o", "--orcid", default="", help="Contact person ORCID (if available)", required=False)
+parser.add_argument("--no-cache", action="store_true", help="Always fetch fresh data from SweCRIS, bypassing the local cache")
 args = parser.parse_args()
 
 # Create Swecris ID and look up corresponding project in Swecris API
@@ -51,43 +54,20 @@ contact_name = args.name
 contact_email = args.email
 contact_orcid = args.orcid
 
-# Funder specific params
-if funder == 'vr':
-    swecrisid = grantid + '_VR'
-    funder_ror = 'https://ror.org/03zttf063'
-elif funder == 'energimyndigheten':
-    swecrisid = grantid + '_Energi'
-    funder_ror = 'https://ror.org/0359z7n90'
-elif funder == 'formas':
-    swecrisid = grantid + '_Formas'
-    funder_ror = 'https://ror.org/03pjs1y45'
-elif funder == 'forte':
-    swecrisid = grantid + '_Forte'
-    funder_ror = 'https://ror.org/02d290r06'
-elif funder == 'rj':
-    swecrisid = grantid + '_RJ'
-    funder_ror = 'https://ror.org/02jkbm893'
-elif funder == 'rymdstyrelsen':
-    swecrisid = grantid + '_SNSB'
-    funder_ror = 'https://ror.org/04t512h04'
-elif funder == 'vinnova':
-    swecrisid = grantid + '_Vinnova'
-    funder_ror = 'https://ror.org/01kd5m353'
-else:
-    print('Invalid Funder. Allowed values are: vr, energimyndigheten, formas, forte, rj, rymdstyrelsen, '
-          'vinnova. Exiting.')
+# Funder specific params, see funders.json
+funder_entry = funders.get(funder)
+if funder_entry is None:
+    print('Invalid Funder. Allowed values are: ' + ', '.join(funders.acronyms()) + '. Exiting.')
     exit()
+swecrisid = grantid + funder_entry['suffix']
+funder_ror = funder_entry['ror']
 
-# Fetch data from SweCRIS
-swecris_url = os.getenv('SWECRIS_URL') + swecrisid
-swecris_headers = {'Accept': 'application/json',
-                   'Authorization': 'Bearer ' + os.getenv("SWECRIS_API_KEY")}
+# Fetch data from SweCRIS (through the local cache, see swecris_cache.py)
 try:
-    swecrisdata = requests.get(url=swecris_url, headers=swecris_headers).text
-    if 'Internal server error' in swecrisdata:
+    swecrisdata = swecris_cache.fetch_project(swecrisid, use_cache=not args.no_cache)
+    if swecrisdata is None:
         print('No data for id: ' + swecrisid + ' was found in SweCRIS!')
         exit()
-    swecrisdata = json.loads(swecrisdata)
     project_name = ''
     project_desc = ''
     project_title = swecrisdata['projectTitleEn']
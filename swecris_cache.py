@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+import dmp_files
+import dmp_http
+import dmp_metrics
+
+# Local cache of SweCRIS project data, so that re-running a grant (or a batch)
+# does not fetch the same project from the SweCRIS API again.
+# Entries younger than the TTL are used as is. Older entries are revalidated with
+# If-None-Match / If-Modified-Since when SweCRIS sent an ETag or Last-Modified,
+# and refetched otherwise. The least recently used entries are dropped when the
+# cache grows past its maximum size.
+# Usage: swecrisdata = swecris_cache.fetch_project(swecrisid)  (None if not found)
+#
+# Optional settings in .env:
+# SWECRIS_CACHE      path of the SQLite file (default ~/.cache/dmp-scripts/swecris.sqlite)
+# SWECRIS_CACHE_TTL  seconds an entry is used without asking SweCRIS (default 86400)
+# SWECRIS_CACHE_MAX  maximum number of cached projects (default 10000)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    swecrisid TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS projects_accessed ON projects (accessed_at);
+"""
+
+
+def cache_path():
+    path = os.getenv("SWECRIS_CACHE")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "dmp-scripts", "swecris.sqlite")
+
+
+def ttl():
+    return int(os.getenv("SWECRIS_CACHE_TTL") or 86400)
+
+
+def max_entries():
+    return int(os.getenv("SWECRIS_CACHE_MAX") or 10000)
+
+
+def _connection():
+    return dmp_files.sqlite_connection(cache_path(), SCHEMA)
+
+
+def _lookup(swecrisid):
+    return _connection().execute(
+        "SELECT payload, etag, last_modified, fetched_at FROM projects WHERE swecrisid = ?", (swecrisid,)
+    ).fetchone()
+
+
+def _store(swecrisid, payload, etag, last_modified):
+    db = _connection()
+    now = time.time()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?, ?)",
+            (swecrisid, payload, etag, last_modified, now, now),
+        )
+        # LRU eviction, keep the most recently used entries
+        db.execute(
+            "DELETE FROM projects WHERE swecrisid IN ("
+            " SELECT swecrisid FROM projects ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries(),),
+        )
+
+
+def _touch(swecrisid, revalidated=False):
+    db = _connection()
+    now = time.time()
+    with db:
+        if revalidated:
+            db.execute("UPDATE projects SET accessed_at = ?, fetched_at = ? WHERE swecrisid = ?", (now, now, swecrisid))
+        else:
+            db.execute("UPDATE projects SET accessed_at = ? WHERE swecrisid = ?", (now, swecrisid))
+
+
+def _parse(response):
+    # None if SweCRIS does not know the project: 404, or the 500 "Internal server error"
+    # SweCRIS answers for unknown ids. Other error answers are raised.
+    kind = dmp_http.classify(response.status_code)
+    if kind == "not_found" or (kind == "server" and "Internal server error" in response.text):
+        return None
+    dmp_http.raise_for_status(response)
+    return json.loads(response.text)
+
+
+def fetch_project(swecrisid, use_cache=True):
+    # Fetch data from SweCRIS (or the cache), None if the project could not be found
+    swecris_url = os.getenv("SWECRIS_URL") + swecrisid
+    swecris_headers = {
+        "Accept": "application/json",
+        "Authorization": "Bearer " + os.getenv("SWECRIS_API_KEY"),
+    }
+    if not use_cache:
+        return _parse(dmp_http.get(url=swecris_url, headers=swecris_headers))
+
+    cached = _lookup(swecrisid)
+    if cached is not None:
+        payload, etag, last_modified, fetched_at = cached
+        if time.time() - fetched_at < ttl():
+            _touch(swecrisid)
+            dmp_metrics.cache("swecris", "hit", swecrisid)
+            return json.loads(payload)
+        if etag:
+            swecris_headers["If-None-Match"] = etag
+        if last_modified:
+            swecris_headers["If-Modified-Since"] = last_modified
+
+    response = dmp_http.get(url=swecris_url, headers=swecris_headers)
+    if response.status_code == 304 and cached is not None:
+        _touch(swecrisid, revalidated=True)
+        dmp_metrics.cache("swecris", "revalidated", swecrisid)
+        return json.loads(cached[0])
+
+    dmp_metrics.cache("swecris", "miss", swecrisid)
+    swecrisdata = _parse(response)
+    if swecrisdata is not None and response.status_code == 200:
+        _store(swecrisid, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return swecrisdata
+
+
+def clear():
+    db = _connection()
+    with db:
+        db.execute("DELETE FROM projects")
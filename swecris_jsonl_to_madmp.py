@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from functools import partial
+from multiprocessing import Pool
+from dotenv import load_dotenv
+
+import madmp
+import madmp_validate
+
+# Simple script that converts a JSONL dump of SweCRIS projects (one project per line) into
+# maDMP records (one {"dmp": {...}} per line), offline, using the same mapping as
+# swecris_to_dmponline.py (see madmp.py). Records are streamed through a generator
+# pipeline, so memory use does not grow with the size of the dump. With -p the
+# transformation is spread over a pool of processes, the output order is kept.
+# With --validate every record is checked against the maDMP schema (see madmp_validate.py),
+# invalid records are reported on stderr and left out of the output. Lines that are not valid
+# JSON or miss a field of the mapping are reported with their line number and skipped.
+# Example: ./python3 swecris_jsonl_to_madmp.py projects.jsonl madmp.jsonl -n "Albert Einstein" -e aeinstein@example.com -t 439 -p 4
+
+# Settings
+load_dotenv()
+
+CHUNK_SIZE = 256  # lines handed to a worker process at a time
+
+
+def read_lines(path):
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, encoding="utf-8") as in_file:
+        yield from in_file
+
+
+def transform_line(numbered_line, lang, contact_name, contact_email, templateid, validate=False):
+    # One (line number, JSONL line) in, (JSONL line out, schema errors, problem) back. The output
+    # is None for empty lines, unknown funders, invalid records and lines that could not be
+    # converted, problem says why for the latter. Parsing, validation and serialising happen
+    # here so they also run in the worker processes.
+    number, line = numbered_line
+    line = line.strip()
+    if not line:
+        return None, [], None
+    try:
+        swecrisdata = json.loads(line)
+        swecrisid = swecrisdata.get("projectId", "")
+        funder = madmp.funder_of(swecrisid)
+        if funder is None:
+            return None, [], None
+        swecrisid, funder_ror = madmp.funder_params(swecrisid.rsplit("_", 1)[0], funder)
+        dmp = madmp.swecris_to_madmp(swecrisdata, swecrisid, funder, funder_ror, lang,
+                                     contact_name, contact_email, templateid)
+    except ValueError as e:
+        return None, [], "line " + str(number) + ": not valid JSON (" + str(e) + ")"
+    except KeyError as e:
+        return None, [], "line " + str(number) + ": project has no " + str(e)
+    except (AttributeError, TypeError) as e:
+        return None, [], "line " + str(number) + ": not a SweCRIS project (" + str(e) + ")"
+    if validate:
+        errors = madmp_validate.validate(dmp)
+        if errors:
+            return None, ["line " + str(number) + ", " + swecrisid + ": " + error for error in errors], None
+    return json.dumps(dmp, ensure_ascii=False) + "\n", [], None
+
+
+def transform(lines, transform_one, processes=1):
+    # Generator pipeline: lines -> maDMP lines, in a process pool if processes > 1
+    numbered_lines = enumerate(lines, 1)
+    if processes > 1:
+        with Pool(processes) as pool:
+            yield from pool.imap(transform_one, numbered_lines, chunksize=CHUNK_SIZE)
+    else:
+        yield from map(transform_one, numbered_lines)
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Convert a JSONL file of SweCRIS projects to maDMP JSONL.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("input", help="JSONL file with one SweCRIS project per line, - for stdin")
+    parser.add_argument("output", help="JSONL file to write the maDMP records to, - for stdout")
+    parser.add_argument("-l", "--lang", default="eng", help="Language used in DMP, possible values: swe, eng")
+    parser.add_argument("-n", "--name", default="", help="Full name of contact person for the DMPs")
+    parser.add_argument("-e", "--email", default="", help="Contact person e-mail")
+    parser.add_argument("-t", "--template", default="", help="DMP Online template ID")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--validate", action="store_true", help="Leave out records that do not validate against the maDMP schema")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.validate:
+        try:
+            madmp_validate.load_schema()  # fail early here, not in every worker
+        except madmp_validate.SchemaError as e:
+            print(str(e) + ". Exiting.", file=sys.stderr)
+            exit(1)
+    transform_one = partial(transform_line, lang=args.lang, contact_name=args.name,
+                            contact_email=args.email, templateid=args.template, validate=args.validate)
+    written = 0
+    skipped = 0
+    invalid = 0
+    unreadable = 0
+    out_file = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for result, errors, problem in transform(read_lines(args.input), transform_one, args.processes):
+            if problem:
+                unreadable += 1
+                print(problem, file=sys.stderr)
+                continue
+            if errors:
+                invalid += 1
+                for error in errors:
+                    print(error, file=sys.stderr)
+                continue
+            if result is None:
+                skipped += 1
+                continue
+            out_file.write(result)
+            written += 1
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+    print("Wrote " + str(written) + " maDMP records, skipped " + str(skipped) + " lines, " + str(invalid) +
+          " invalid records, " + str(unreadable) + " unreadable lines.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
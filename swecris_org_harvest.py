@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests
+import json
+import glob
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+import os
+
+import dmp_auth
+import dmp_http
+import dmp_metrics
+import dmponline_pages
+import madmp
+import madmp_validate
+import swecris_to_dmponline
+import upload_ledger
+
+# Simple script that fetches all SweCRIS projects for our organisation (DEFAULT_AFF /
+# DEFAULT_AFF_ROR in .env, or SWECRIS_ORG_ID) and creates DMPs in DMPonline for the
+# projects that do not have one yet. Existing plans are found through the DMPonline plans
+# listing, the upload ledger and Uploaded_plans, and compared by grant id as sets.
+# SweCRIS has no e-mail addresses, so new plans get the contact person given with -n/-e.
+# Example: ./python3 swecris_org_harvest.py -n "Research Data Office" -e rdo@example.com -t 439 --dry-run
+#
+# // matves29@kth.se
+
+# Settings
+load_dotenv()  # loads the .env file which contains login-information
+affiliation = os.getenv("DEFAULT_AFF")
+affiliation_ror = os.getenv("DEFAULT_AFF_ROR")
+
+yes = {"yes", "y", "ye", "j", "ja", ""}
+no = {"no", "n", "nej"}
+
+PAGE_SIZE = 500
+
+
+def swecris_get(path, params=None):
+    # SWECRIS_URL points at .../v1/projects/, other resources live next to it
+    swecris_api = os.getenv("SWECRIS_URL").rstrip("/").rsplit("/", 1)[0] + "/"
+    swecris_headers = {
+        "Accept": "application/json",
+        "Authorization": "Bearer " + os.getenv("SWECRIS_API_KEY"),
+    }
+    response = dmp_http.get(url=swecris_api + path, headers=swecris_headers, params=params)
+    dmp_http.raise_for_status(response)
+    return json.loads(response.text)
+
+
+def find_organisation_id():
+    # SWECRIS_ORG_ID if set, otherwise the SweCRIS organisation matching DEFAULT_AFF_ROR or DEFAULT_AFF
+    org_id = os.getenv("SWECRIS_ORG_ID")
+    if org_id:
+        return org_id
+    wanted = {value.strip().lower() for value in (affiliation, affiliation_ror) if value}
+    if affiliation_ror:
+        wanted.add(affiliation_ror.rstrip("/").rsplit("/", 1)[-1].lower())
+    for organisation in swecris_get("organisations"):
+        values = {str(value).strip().lower() for value in organisation.values() if isinstance(value, str)}
+        if values & wanted:
+            return organisation["organisationId"]
+    return None
+
+
+def fetch_project_page(org_id, page, page_size=PAGE_SIZE):
+    return swecris_get("projects/organisations/" + org_id, params={"page": page, "pageSize": page_size})
+
+
+def iter_projects(org_id, workers=4, page_size=PAGE_SIZE):
+    # Pages are fetched `workers` at a time until a page comes back short.
+    # If SweCRIS ignores the paging parameters the first page holds everything.
+    first = fetch_project_page(org_id, 1, page_size)
+    yield from first
+    if len(first) != page_size:
+        return
+    page = 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            pages = list(pool.map(lambda p: fetch_project_page(org_id, p, page_size), range(page, page + workers)))
+            for projects in pages:
+                yield from projects
+                if len(projects) < page_size:
+                    return
+            page += workers
+
+
+def grant_ids_of(item):
+    # All grant ids of a plan (RDA item), both as given and without the SweCRIS funder suffix
+    ids = set()
+    for project in item.get("dmp", {}).get("project") or []:
+        for funding in project.get("funding") or []:
+            identifier = (funding.get("grant_id") or {}).get("identifier")
+            if identifier:
+                ids.add(identifier)
+                ids.add(identifier.rsplit("_", 1)[0])
+    return ids
+
+
+def existing_grant_ids(workers=4):
+    # Grant ids that already have a plan in DMPonline, in the upload ledger or in Uploaded_plans
+    known = set()
+    for swecrisid in upload_ledger.known_swecrisids():
+        known |= {swecrisid, swecrisid.rsplit("_", 1)[0]}
+    for item in dmponline_pages.iter_items("plans", workers=workers):
+        known |= grant_ids_of(item)
+    for path in glob.glob(os.path.join("Uploaded_plans", "*.json")):
+        try:
+            with open(path, encoding="utf-8") as uf:
+                for item in json.load(uf).get("items") or []:
+                    known |= grant_ids_of(item)
+        except (OSError, ValueError, AttributeError):
+            continue
+    return known
+
+
+def new_projects(projects, known, since=""):
+    # Projects from a funder we know, started on/after `since`, whose grant id has no plan yet
+    found = {}
+    for project in projects:
+        swecrisid = project.get("projectId", "")
+        if madmp.funder_of(swecrisid) is None:
+            continue
+        if since and (project.get("projectStartDate") or "") < since:
+            continue
+        found[swecrisid] = project
+    new_ids = set(found) - known
+    new_ids = {swecrisid for swecrisid in new_ids if swecrisid.rsplit("_", 1)[0] not in known}
+    return [found[swecrisid] for swecrisid in sorted(new_ids)]
+
+
+def create_plan(project, args, templateid):
+    # Builds, validates, uploads and stores the plan of a project with the stages of
+    # swecris_to_dmponline.py. Returns (swecrisid, status, message)
+    swecrisid = project["projectId"]
+    grant = {"grantid": swecrisid.rsplit("_", 1)[0], "funder": madmp.funder_of(swecrisid), "name": args.name,
+             "email": args.email, "template": templateid, "lang": args.lang, "orcid": ""}
+    stages = [stage.process for stage in swecris_to_dmponline.create_stages(validate=not args.no_validate)]
+    unit = {"grant": grant}
+    # The organisation listing may leave out details, then the fetch stage gets the full project
+    if "peopleList" in project and "projectAbstractEn" in project:
+        swecrisid, funder_ror = madmp.funder_params(grant["grantid"], grant["funder"])
+        unit.update(swecrisid=swecrisid, funder_ror=funder_ror, swecrisdata=project)
+        stages = stages[1:]
+    for process in stages:
+        process(unit)
+        if "status" in unit:
+            break
+    return unit.get("swecrisid", swecrisid), unit["status"], unit["message"]
+
+
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Create DMPs for all SweCRIS projects of our organisation that do not have one.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-n", "--name", default="", help="Full name of contact person for the new DMPs", required=True)
+    parser.add_argument("-e", "--email", default="", help="Contact person e-mail", required=True)
+    parser.add_argument("-t", "--template", default="", help="DMP Online template ID or name", required=True)
+    parser.add_argument("-l", "--lang", default="eng", help="Language used in DMP, possible values: swe, eng")
+    parser.add_argument("--since", default="", help="Only projects starting on or after this date (YYYY-MM-DD)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of concurrent requests")
+    parser.add_argument("--no-validate", action="store_true", help="Upload without validating against the maDMP schema")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the projects that would get a DMP")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    templateid = swecris_to_dmponline.resolve_template(args.template)
+    if templateid is None:
+        exit()
+
+    # Load and compile the schema once, before any plan is created
+    if not args.no_validate:
+        try:
+            madmp_validate.get_validator()
+        except madmp_validate.SchemaError as e:
+            print(str(e) + ". Use --no-validate to upload anyway. Exiting.")
+            exit()
+
+    try:
+        org_id = find_organisation_id()
+        if org_id is None:
+            print("Could not find " + str(affiliation) + " in SweCRIS. Set SWECRIS_ORG_ID in .env. Exiting.")
+            exit()
+        projects = list(iter_projects(org_id, workers=args.workers))
+        print("Found " + str(len(projects)) + " projects for organisation " + org_id + " in SweCRIS.")
+        known = existing_grant_ids(workers=args.workers)
+        print("Found " + str(len(known)) + " grant ids with existing plans.")
+    except (requests.exceptions.RequestException, dmp_auth.AuthenticationError) as e:
+        print("Failed! " + str(e))
+        exit()
+
+    todo = new_projects(projects, known, args.since)
+    print(str(len(todo)) + " projects have no DMP yet.")
+    if args.verbose or args.dry_run:
+        for project in todo:
+            print("  " + project["projectId"] + ": " + str(project.get("projectTitleEn")))
+    if args.dry_run or not todo:
+        exit()
+
+    print("Should I create " + str(len(todo)) + " new DMPs in DMP Online? (y/n)")
+    choice = "y" if args.yes else input().lower()
+    if choice in yes:
+        created = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(create_plan, project, args, templateid): project for project in todo}
+            for future in as_completed(futures):
+                try:
+                    swecrisid, status, message = future.result()
+                except (requests.exceptions.RequestException, dmp_auth.AuthenticationError,
+                        madmp_validate.SchemaError, ValueError, KeyError) as e:
+                    swecrisid, status, message = futures[future]["projectId"], "failed", str(e)
+                dmp_metrics.inc("grants", status=status)
+                if status == "created":
+                    created += 1
+                else:
+                    failed += 1  # failed or invalid
+                print(swecrisid + ": " + status + " (" + message + ")")
+        print("Done. Created: " + str(created) + ", failed: " + str(failed))
+
+    elif choice in no:
+        print("OK. Will exit then.")
+        exit()
+    else:
+        sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
+
+    exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,32 @@
 
 import requests
 import json
+import csv
 import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from dotenv import load_dotenv
-from datetime import datetime
 import os
-import uuid
+
+import dmp_auth
+import dmp_http
+import dmp_metrics
+import funders
+import madmp
+import madmp_validate
+import run_journal
+import run_pipeline
+import swecris_cache
+import template_index
+import upload_ledger
 
 # Simple cript for creating new DMP:s (projects) in DMP Online using basic data
 # from SweCRIS. Work in progress, use as is.
 # Example: ./python3 swecris2dmponlineV2.py -i 2021-04241 -f vr -n "Albert Einstein" -e aeinstein@example.com -o 0000-0001-1234-567x -t 439
+# Batch example: ./python3 swecris_to_dmponline.py -b grants.csv -w 8 --yes
+# Batch mode runs the grants through the stages fetch, build, upload and persist, each with its
+# own threads (--fetch-workers, --upload-workers, ...), see run_pipeline.py.
 #
 # / urban.andersson@chalmers.se
 # // matves29@kth.se
@@ -27,292 +43,431 @@ logfile = os.getenv("LOGFILE")
 affiliation = os.getenv("DEFAULT_AFF")
 affiliation_abbrev = os.getenv("DEFAULT_AFF_ABBREV")
 
-# Input params
-parser = ArgumentParser(description="Create new DMP using data from Swecris.", formatter_class=ArgumentDefaultsHelpFormatter,)
-parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
-parser.add_argument("-i", "--grantid", default="", help="Grant ID, i.e. 2023-012345", required=True)
-parser.add_argument("-f", "--funder", default="vr", help="Funder acronym. Allowed values: vr, energimyndigheten, "
-                                                         "formas, forte, rj, rymdstyrelsen, vinnova", required=True,)
-parser.add_argument("-l", "--lang", default="eng", help="Language used in DMP, possible values: swe, eng", required=False,)
-parser.add_argument("-n", "--name", default="", help="Full name of contact person for DMP", required=True,)
-parser.add_argument("-e", "--email", default="", help="Contact person e-mail", required=True)
-parser.add_argument("-o", "--orcid", default="", help="Contact person ORCID (if available)", required=False,)
-parser.add_argument("-t", "--template", default="", help="DMP Online template ID", required=True)
-args = parser.parse_args()
-
-# Create Swecris ID and look up corresponding project in Swecris API
-swecrisid = ""
-funder_ror = ""
-grantid = args.grantid
-funder = args.funder
-lang = args.lang
-contact_name = args.name
-contact_email = args.email
-contact_orcid = args.orcid
-templateid = args.template
-
-# Funder specific params
-if funder == "vr":
-    swecrisid = grantid + "_VR"
-    funder_ror = "https://ror.org/03zttf063"
-elif funder == "energimyndigheten":
-    swecrisid = grantid + "_Energi"
-    funder_ror = "https://ror.org/0359z7n90"
-elif funder == "formas":
-    swecrisid = grantid + "_Formas"
-    funder_ror = "https://ror.org/03pjs1y45"
-elif funder == "forte":
-    swecrisid = grantid + "_Forte"
-    funder_ror = "https://ror.org/02d290r06"
-elif funder == "rj":
-    swecrisid = grantid + "_RJ"
-    funder_ror = "https://ror.org/02jkbm893"
-elif funder == "rymdstyrelsen":
-    swecrisid = grantid + "_SNSB"
-    funder_ror = "https://ror.org/04t512h04"
-elif funder == "vinnova":
-    swecrisid = grantid + "_Vinnova"
-    funder_ror = "https://ror.org/01kd5m353"
-else:
-    print("Invalid Funder. Allowed values are: vr, energimyndigheten, formas, forte, rj, rymdstyrelsen, "
-          "vinnova. Exiting.")
-    exit()
+yes = {"yes", "y", "ye", "j", "ja", ""}
+no = {"no", "n", "nej"}
+
+# Columns read from a batch file (CSV with a header row, or JSONL)
+BATCH_FIELDS = ["grantid", "funder", "name", "email", "template", "lang", "orcid"]
+
+
+def fetch_swecris(swecrisid, use_cache=True):
+    # Fetch data from SweCRIS (through the local cache), None if the project could not be found
+    return swecris_cache.fetch_project(swecrisid, use_cache=use_cache)
+
+
+def detect_funder(grantid, use_cache=True):
+    # Looks the grant id up in SweCRIS with the suffixes of all known funders at the same time.
+    # Returns (funder, swecrisdata) of the first that SweCRIS knows, without waiting for the
+    # others (requests already sent are left to finish in the background), or (None, None).
+    candidates = {madmp.funder_params(grantid, acronym)[0]: acronym for acronym in funders.acronyms()}
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {pool.submit(fetch_swecris, swecrisid, use_cache): swecrisid for swecrisid in candidates}
+    errors = []
+    try:
+        for future in as_completed(futures):
+            try:
+                swecrisdata = future.result()
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+                continue
+            if swecrisdata is not None:
+                return candidates[futures[future]], swecrisdata
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if errors:
+        raise errors[0]  # not found for sure only if every funder answered
+    return None, None
+
+
+def build_madmp(swecrisdata, swecrisid, funder, funder_ror, lang, contact_name, contact_email, templateid):
+    # maDMP record wrapped the way the DMPonline plans API expects it, see madmp.py
+    dmp = madmp.swecris_to_madmp(swecrisdata, swecrisid, funder, funder_ror, lang,
+                                 contact_name, contact_email, templateid, affiliation, affiliation_abbrev)
+    return {"total_items": 1, "items": [dmp]}
+
+
+def check_madmp(jsondmp):
+    # Schema errors of a built record, printed as a list; True if it can be uploaded
+    errors = madmp_validate.validate(jsondmp)
+    for error in errors:
+        print("  " + error)
+    return not errors
+
+
+def post_plan(jsondmp):
+    # Create DMP, returns the raw response which contains the API url for the created plan
+    dmp_postplan_url = os.getenv("DMPONLINE_API_URL") + "plans"
+    postplan_headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "Server-Agent": "Your Application Name",
+    }
+    response = dmp_auth.post(url=dmp_postplan_url, json=jsondmp, headers=postplan_headers)
+    dmp_http.raise_for_status(response)
+    return response.text
+
+
+def store_upload(grantid, contact_name, postdata):
+    if not os.path.exists('Uploaded_plans'):
+        os.makedirs('Uploaded_plans', exist_ok=True)
+    filename = grantid + contact_name + "dmp.json"
+    path = os.path.join('Uploaded_plans', filename)
+    out_file = open(path, "w")
+    out_file.write(postdata)
+    out_file.close()
+    return path
+
+
+def plan_links(postdata):
+    # Link to new DMP, through the API and through a browser
+    dmp_postplan_url = os.getenv("DMPONLINE_API_URL") + "plans"
+    postdata = json.loads(postdata)
+    Linktonewplan = postdata['items'][0]['dmp']['dmp_id']['identifier']
+    GUIlink = dmp_postplan_url[:-12]+"plans" + Linktonewplan[-7:]
+    return Linktonewplan, GUIlink
+
+
+def resolve_template(value):
+    # Numeric template id, or a title/organisation/funder name looked up in the local template index
+    templateid, candidates = template_index.resolve(value)
+    if templateid is None:
+        if candidates:
+            print('Template "' + value + '" matches several templates, please use one of the ids:')
+            for record in candidates:
+                print("  " + record["id"] + ": " + record["title"] + " (" + record["org"] + ", version " +
+                      str(record["version"]) + ")")
+        else:
+            print('Unknown template "' + value + '". Run dmponline_templates.py to update the template index, '
+                  'or use the numeric template id.')
+    return templateid
+
+
+def log_missing(swecrisid):
+    with open(os.getenv("LOGFILE"), "a") as lf:
+        lf.write("No data for id: " + swecrisid + " was found in SweCRIS! Skipping.\n")
+
+
+def read_batch(path):
+    # Read grants from a CSV (with header row) or JSONL file, one grant per row/line
+    rows = []
+    with open(path, encoding="utf-8") as bf:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            for line in bf:
+                if line.strip():
+                    rows.append(json.loads(line))
+        else:
+            for row in csv.DictReader(bf):
+                rows.append(row)
+    grants = []
+    for row in rows:
+        grant = {field: (row.get(field) or "").strip() for field in BATCH_FIELDS}
+        if not grant["funder"]:
+            grant["funder"] = "vr"
+        if not grant["lang"]:
+            grant["lang"] = "eng"
+        grants.append(grant)
+    return grants
+
+
+def fetch_grant(unit, use_cache=True):
+    # Stage fetch: the SweCRIS data of the grant (and its funder, with funder auto)
+    grant = unit["grant"]
+    swecrisdata = None
+    if grant["funder"] == "auto":
+        funder, swecrisdata = detect_funder(grant["grantid"], use_cache)
+        if funder is None:
+            log_missing(grant["grantid"])
+            return run_pipeline.finish(unit, "failed", "no data for grant " + grant["grantid"] +
+                                       " in SweCRIS for any funder")
+        grant = unit["grant"] = dict(grant, funder=funder)
+    swecrisid, funder_ror = madmp.funder_params(grant["grantid"], grant["funder"])
+    if swecrisid is None:
+        return run_pipeline.finish(unit, "failed", "invalid funder " + grant["funder"])
+    # The funder as the registry spells it (VR -> vr), so the record and the hash recorded in
+    # the ledger match what dmponline_reconcile.py rebuilds from the SweCRIS id
+    grant = unit["grant"] = dict(grant, funder=funders.get(grant["funder"])["acronym"])
+    if swecrisdata is None:
+        swecrisdata = fetch_swecris(swecrisid, use_cache)
+    if swecrisdata is None:
+        log_missing(swecrisid)
+        return run_pipeline.finish(unit, "failed", "no data for id " + swecrisid + " in SweCRIS")
+    unit.update(swecrisid=swecrisid, funder_ror=funder_ror, swecrisdata=swecrisdata)
+
+
+def build_grant(unit, validate=True, upload=True):
+    # Stage build: the maDMP record, validated against the schema
+    grant = unit["grant"]
+    jsondmp = build_madmp(unit["swecrisdata"], unit["swecrisid"], grant["funder"], unit["funder_ror"], grant["lang"],
+                          grant["name"], grant["email"], grant["template"])
+    if validate:
+        errors = madmp_validate.validate(jsondmp)
+        if errors:
+            return run_pipeline.finish(unit, "invalid", "; ".join(errors))
+    if not upload:
+        return run_pipeline.finish(unit, "valid", "not uploaded")
+    unit["jsondmp"] = jsondmp
+
+
+def upload_grant(unit, journal=None):
+    # Stage upload: POST the plan to DMPonline
+    if journal is not None:
+        journal.start(grant_unit(unit["grant"]))
+    unit["postdata"] = post_plan(unit["jsondmp"])
+
+
+def persist_grant(unit):
+    # Stage persist: store the answer in Uploaded_plans and the upload ledger
+    grant = unit["grant"]
+    postdata = unit["postdata"]
+    path = unit["path"] = store_upload(grant["grantid"], grant["name"], postdata)
+    dmp_id = upload_ledger.dmp_id_of(postdata)
+    if dmp_id:
+        upload_ledger.record(unit["swecrisid"], grant["email"], dmp_id, grant["template"], grant["lang"],
+                             madmp.source_hash(unit["jsondmp"]))
+    try:
+        Linktonewplan, GUIlink = plan_links(postdata)
+    except (ValueError, KeyError, IndexError, TypeError):
+        return run_pipeline.finish(unit, "failed", "unexpected response from DMPonline, stored as " + path)
+    run_pipeline.finish(unit, "created", GUIlink)
+
+
+def create_stages(use_cache=True, validate=True, upload=True, workers=None, journal=None):
+    # The stages from a grant to a created plan, workers: {stage name: number of threads}
+    workers = workers or {}
+    stages = [("fetch", partial(fetch_grant, use_cache=use_cache)),
+              ("build", partial(build_grant, validate=validate, upload=upload))]
+    if upload:
+        stages += [("upload", partial(upload_grant, journal=journal)),
+                   ("persist", persist_grant)]
+    return [run_pipeline.Stage(name, process, workers.get(name, 1)) for name, process in stages]
+
+
+def run_batch(args):
+    grants = read_batch(args.batch)
+    incomplete = [g for g in grants if not (g["grantid"] and g["name"] and g["email"] and g["template"])]
+    if incomplete:
+        print("Every row needs grantid, name, email and template. Incomplete rows: " +
+              ", ".join(g["grantid"] or "(no grantid)" for g in incomplete))
+        exit()
 
-# Fetch data from SweCRIS
-swecris_url = os.getenv("SWECRIS_URL") + swecrisid
-swecris_headers = {
-    "Accept": "application/json",
-    "Authorization": "Bearer " + os.getenv("SWECRIS_API_KEY"),
-}
-try:
-    swecrisdata = requests.get(url=swecris_url, headers=swecris_headers).text
-    if "Internal server error" in swecrisdata:
-        print("No data for id: " + swecrisid + " was found in SweCRIS!")
+    # Resolve template names once per distinct value
+    templateids = {value: resolve_template(value) for value in {g["template"] for g in grants}}
+    if None in templateids.values():
+        exit()
+    for grant in grants:
+        grant["template"] = templateids[grant["template"]]
+
+    # Skip grants that already have a plan for the same contact (see upload_ledger.py)
+    if not args.force:
+        todo = {}
+        skipped = 0
+        for grant in grants:
+            swecrisid, funder_ror = madmp.funder_params(grant["grantid"], grant["funder"])
+            key = (swecrisid or grant["grantid"], grant["email"].lower())
+            # With funder auto the plan may be recorded under any of the funders
+            swecrisids = [swecrisid] if swecrisid is not None else []
+            if grant["funder"] == "auto":
+                swecrisids = [madmp.funder_params(grant["grantid"], acronym)[0] for acronym in funders.acronyms()]
+            if key in todo or any(upload_ledger.lookup(candidate, grant["email"]) for candidate in swecrisids):
+                skipped += 1
+                continue
+            todo[key] = grant
+        grants = list(todo.values())
+        if skipped:
+            print("Skipping " + str(skipped) + " grants that already have a plan or are listed twice (use --force to create them anyway).")
+        if not grants:
+            print("Nothing to do.")
+            exit()
+
+    # Threads per stage of the pipeline (see run_pipeline.py)
+    workers = {"fetch": args.fetch_workers or args.workers, "build": args.build_workers,
+               "upload": args.upload_workers or args.workers, "persist": args.persist_workers}
+    if args.validate_only:
+        stages = create_stages(use_cache=not args.no_cache, upload=False, workers=workers)
+        run_grants(grants, stages, args.queue_size, verbose=args.verbose)
+        return
+
+    if not args.yes:
+        print("Should I create " + str(len(grants)) + " new DMPs in DMP Online from " + args.batch + "? (y/n)")
+        choice = input().lower()
+        if choice not in yes:
+            print("OK. Will exit then.")
+            exit()
+
+    # Authorize once up front, the token is cached and shared by all workers
+    try:
+        dmp_auth_bearer = dmp_auth.get_token()
+    except requests.exceptions.RequestException as e:
+        dmp_auth_bearer = None
+    if dmp_auth_bearer is None:
+        print("Authentication request failed! Exiting.")
+        exit()
+
+    # Journal the run, so an interrupted batch can go on with --resume (see run_journal.py)
+    journal = run_journal.Journal("create_" + run_journal.job_key([os.path.abspath(args.batch)]), resume=args.resume)
+    if args.resume:
+        print("Resuming: " + journal.summary())
+        if journal.in_flight:
+            print("These grants were being created when the run stopped and are queued again, check that they "
+                  "did not get a plan already: " + ", ".join(sorted(journal.in_flight)))
+        grants = journal.remaining(grants, key=grant_unit)
+
+    stages = create_stages(use_cache=not args.no_cache, validate=not args.no_validate, workers=workers,
+                           journal=journal)
+    try:
+        run_grants(grants, stages, args.queue_size, journal, args.verbose)
+        journal.close(finished=True)
+    finally:
+        journal.close()
+
+
+def grant_unit(grant):
+    # A grant in the journal
+    return grant["grantid"] + " " + grant["email"].lower()
+
+
+def run_grants(grants, stages, queue_size, journal=None, verbose=False):
+    # Runs the grants through the stages and prints a line per grant and a summary
+    counts = {}
+
+    def done(unit):
+        grant = unit["grant"]
+        status, message = unit["status"], unit["message"]
+        counts[status] = counts.get(status, 0) + 1
+        dmp_metrics.inc("grants", status=status)
+        if journal is not None:
+            if status == "created":
+                journal.complete(grant_unit(grant), message)
+            else:
+                journal.fail(grant_unit(grant), message)
+        print(grant["grantid"] + ": " + status + " (" + message + ")")
+
+    # Errors that fail a single grant, the other grants go on
+    errors = (requests.exceptions.RequestException, dmp_auth.AuthenticationError, madmp_validate.SchemaError,
+              ValueError, KeyError)
+    run_pipeline.run(({"grant": grant} for grant in grants), stages, done, queue_size, errors)
+    if verbose:
+        for stage in stages:
+            print("  " + stage.summary())
+    print("Done. " + ", ".join(status.capitalize() + ": " + str(count) for status, count in sorted(counts.items())))
+
+
+def check_ledger(swecrisid, contact_email, force):
+    # Exits if the ledger already has a plan for the grant and contact (see upload_ledger.py)
+    dmp_id = upload_ledger.lookup(swecrisid, contact_email)
+    if dmp_id and not force:
+        print("A plan for " + swecrisid + " and " + contact_email + " has already been created: " + dmp_id)
+        print("Use --force to create another one. Exiting.")
         exit()
-    swecrisdata = json.loads(swecrisdata)
-    project_name = ""
-    project_desc = ""
-    project_title = swecrisdata["projectTitleEn"]
-    if lang == "swe":
-        project_title = swecrisdata["projectTitleSv"]
-    project_desc = swecrisdata["projectAbstractEn"]
-    if lang == "swe":
-        project_desc = swecrisdata["projectAbstractSv"]
-    if project_desc == "":
-        project_desc = "(missing)"
-        if lang == "swe":
-            project_desc = "(saknas)"
-    project_start = swecrisdata["projectStartDate"]  # replaced fundingStartDate
-    project_end = swecrisdata["projectEndDate"]  # replaced fundingEndDate
-
-    funder_name = swecrisdata["fundingOrganisationNameEn"]
-    if lang == "swe":
-        funder_name = swecrisdata["fundingOrganisationNameSv"]
+
+
+def run_single(args):
+    # One grant through the same stages as in batch mode (see create_stages), with a prompt
+    # before the record is built and before it is uploaded
+    funder = args.funder
+    lang = args.lang
+    contact_email = args.email
+    templateid = resolve_template(args.template)
+    if templateid is None:
+        exit()
+    grant = {"grantid": args.grantid, "funder": funder, "name": args.name, "email": contact_email,
+             "template": templateid, "lang": lang, "orcid": args.orcid}
+    fetch, build, upload, persist = [stage.process for stage in
+                                     create_stages(use_cache=not args.no_cache, validate=False)]
+
+    # Funder specific params, with funder auto the funder is the one SweCRIS knows the grant for
+    if funder != "auto":
+        swecrisid, funder_ror = madmp.funder_params(args.grantid, funder)
+        if swecrisid is None:
+            print("Invalid Funder. Allowed values are: " + ", ".join(funders.acronyms()) + " and auto. Exiting.")
+            exit()
+        check_ledger(swecrisid, contact_email, args.force)
+
+    unit = {"grant": grant}
+    try:
+        fetch(unit)
+    except requests.exceptions.RequestException as e:
+        print("Failed! " + str(e))
+        exit()
+    if "status" in unit:
+        if funder == "auto":
+            print("No data for grant " + args.grantid + " was found in SweCRIS for any funder (" +
+                  ", ".join(funders.acronyms()) + ").")
+        else:
+            print("No data for id: " + swecrisid + " was found in SweCRIS!")
+        exit()
+    if funder == "auto":
+        print("Funder: " + unit["grant"]["funder"])
+        check_ledger(unit["swecrisid"], contact_email, args.force)
 
     if lang == "swe":
         print(
             'Hittade information om projektet "'
-            + project_title
+            + madmp.project_title(unit["swecrisdata"], lang)
             + '" i Swecris API! Ska vi skapa en DHP? (j/n)'
         )
     else:
         print(
             'Got data for project "'
-            + project_title
+            + madmp.project_title(unit["swecrisdata"], lang)
             + '" from Swecris API! Create DMP? (y/n)'
         )
 
-    yes = {"yes", "y", "ye", "j", "ja", ""}
-    no = {"no", "n", "nej"}
-    choice = input().lower()
+    choice = "y" if args.yes else input().lower()
 
     if choice in yes:
-        # Create maDMP
-        dmp = {}
-        madmp_schema = (
-            "https://github.com/RDA-DMP-Common/RDA-DMP-Common-Standard/tree/master/examples/JSON/JSON"
-            "-schema/1.0"
-        )  # will be changed by DMPonline nonetheless.
-
-        d = dict()
-
-        # Basic data
-        d["schema"] = madmp_schema
-        created_at = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        d["title"] = project_title  # actually project tile
-        d["description"] = project_desc  # actually project description
-        d["language"] = lang
-        d["created"] = created_at
-        d["ethical_issues_exist"] = "unknown"
-
-        # Contact person
-        # This is handled by the script params. Please note that if the user exists in DMPonline, DMPonline will add information to the system.
-        # At the moment Orcid is problematic and thus commented out.
-        # Contact
-        cnt = {
-            "name": contact_name,
-            "mbox": contact_email,
-            "affiliation": {"name": affiliation, "abbreviation": affiliation_abbrev},
-        }
-        # if contact_orcid:
-        #    cnt["contact_id"] = {"identifier": "https://orcid.org/" + contact_orcid, "type": "orcid"}
-        d["contact"] = cnt
-
-        # Contributors
-        cs = []
-        for persons in swecrisdata["peopleList"]:
-            ct = {}
-            orcid = ""
-            ct["name"] = persons['fullName']
-            # Role
-            ct["role"] = ["other"]  # uneditable and not considered, but can be included
-            if lang == "swe":
-                ct["role"] = ["other"]
-            ct["affiliation"] = {
-                "name": affiliation,
-                "abbreviation": affiliation_abbrev,
-            }
-            # Orcid - this is currently to problematic to use
-            # if "orcId" in persons:
-            #    orcid = "https://orcid.org/" + persons['orcId']
-            # ct["contributor_id"] = {"identifier": orcid, "type": "orcid"}   #MASSIVE HEADACHE keeps changing to some default orcid.
-            cs.append(ct)
-
-        d["contributor"] = cs
-        
-
-        # Project info
-        ps = []
-        pt = {
-            "title": project_title,
-            "description": project_desc,
-            "start": project_start,
-            "end": project_end,
-        }
-        # Funder
-        pfl = []
-        pfn = {
-            "name": funder,
-            "funder_id": {"type": "ror", "identifier": funder_ror}, # keeps getting changed to "https://ror.org/123abc45y" cannot figure out why.
-            "grant_id": {"identifier": swecrisid, "type": "other"},
-            "funding_status": "granted",
-        }  # Please note that grantIDs need to be unique. if they already exist then the field will become blank.
-        pfl.append(pfn)
-        pt["funding"] = pfl
-        ps.append(pt)
-        d["project"] = ps
-
-        # Dataset (dummy, standard compliance)
-        dsts_empty = []
-        dset_empty = {
-            "type": "dataset",
-            "title": "Generic dataset",
-            "description": "No individual datasets have been defined for this DMP.",
-        }
-        dsts_empty.append(dset_empty)
-        d["dataset"] = dsts_empty
-
-        # DMP template
-        extension = [
-            {
-                "dmproadmap": {
-                    "template": {
-                        "id": templateid,
-                        "title": "",
-                    }
-                }
-            }
-        ]
-
-        d["extension"] = extension
-
         # Create (and print) maDMP record
-        dmp["dmp"] = d
-        jsondmp = {"total_items": 1, "items": [dmp]}
+        build(unit)
+        jsondmp = unit["jsondmp"]
         print(json.dumps(jsondmp, indent=2))
-
-        
+        if not args.no_validate:
+            if not check_madmp(jsondmp):
+                print("The maDMP record does not follow the RDA DMP Common Standard (see above). Exiting.")
+                exit()
+            print("The maDMP record is valid.")
+        if args.validate_only:
+            exit()
+    else:
+        print("OK. Will exit then.")
+        exit()
 
     # Go ahead and create DMP in DMPOnline from here...
     print("Should I create a new DMP using these data in DMP Online? (y/n)")
-    yes = {"yes", "y", "ye", "j", "ja", ""}
-    no = {"no", "n", "nej"}
-    choice = input().lower()
+    choice = "y" if args.yes else input().lower()
     if choice in yes:
 
         # Authorize
-        dmp_auth_bearer = ""
-        dmp_auth_url = os.getenv("DMPONLINE_API_URL") + "authenticate"
-        auth_headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
-        auth_body = {
-            "grant_type": "authorization_code",
-            "email": os.getenv("DMPONLINE_USER"),
-            "code": os.getenv("DMPONLINE_AUTH_CODE"),
-        }
         try:
-            authdata = requests.post(
-                url=dmp_auth_url, json=auth_body, headers=auth_headers
-            ).text
-            
-            if "Internal server error" in authdata:
+            dmp_auth_bearer = dmp_auth.get_token()
+            if dmp_auth_bearer is None:
                 print("Authentication request failed! Exiting.")
                 exit()
 
-            authdata = json.loads(authdata)
-            dmp_auth_bearer = authdata["access_token"]
-            
             print("Authorized! Access token: " + dmp_auth_bearer)
 
         except requests.exceptions.HTTPError as e:
-            print("Failed! authdata: " + authdata)
+            print("Failed! authdata: " + str(e))
             exit()
 
         # Create DMP
         try:
-
-            dmp_postplan_url = os.getenv("DMPONLINE_API_URL") + "plans"
-            postplan_headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Server-Agent": "Your Application Name",
-                "Authorization": "Bearer " + dmp_auth_bearer,
-            }
-            
-            postdata = requests.post(
-                url=dmp_postplan_url, json=jsondmp, headers=postplan_headers
-            ).text
-            print(postdata) # contains API url for the created plan
-            
-            if not os.path.exists('Uploaded_plans'):
-                os.makedirs('Uploaded_plans') 
-            filename = grantid + contact_name + "dmp.json"
-            path = os.path.join('Uploaded_plans', filename)
-            out_file = open(path, "w") 
-            out_file.write(postdata) 
-            out_file.close()
-            print("Stored as: " + path)
-
-            # Link to new DMP
-
-            postdata = json.loads(postdata)
-            Linktonewplan = postdata['items'][0]['dmp']['dmp_id']['identifier']
-            GUIlink = dmp_postplan_url[:-12]+"plans" + Linktonewplan[-7:]
-            print("A new plan has been created! You can access it through API: " + Linktonewplan + 
-                  "\nor a browser: " + GUIlink)
-
+            upload(unit)
+            print(unit["postdata"])  # contains API url for the created plan
+            persist(unit)
         except requests.exceptions.HTTPError as e:
-            print("Failed! postdata: " + postdata)
+            dmp_metrics.inc("grants", status="failed")
+            print("Failed! " + str(e) + "\n" + e.response.text)
+            exit()
+        print("Stored as: " + unit["path"])
+        dmp_metrics.inc("grants", status=unit["status"])
+        if unit["status"] != "created":
+            print("Failed! " + unit["message"])
             exit()
 
         # Link to new DMP
-        
-
-    elif choice in no:
-        print("OK. Will exit then.")
-        exit()
+        Linktonewplan, GUIlink = plan_links(unit["postdata"])
+        print("A new plan has been created! You can access it through API: " + Linktonewplan +
+              "\nor a browser: " + GUIlink)
 
     elif choice in no:
         print("OK. Will exit then.")
@@ -321,9 +476,65 @@ try:
         sys.stdout.write("Please respond with 'y'(es) or 'n'(o)")
 
 
-except requests.exceptions.HTTPError as e:
-    print("No data for id: " + swecrisid + " was found in SweCRIS!")
-    print("\n")
-    with open(os.getenv("LOGFILE"), "a") as lf:
-        lf.write("No data for id: " + swecrisid + " was found in SweCRIS! Skipping.")
-exit()
+def build_parser():
+    # Input params
+    parser = ArgumentParser(description="Create new DMP using data from Swecris.", formatter_class=ArgumentDefaultsHelpFormatter,)
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase verbosity")
+    parser.add_argument("-i", "--grantid", default="", help="Grant ID, i.e. 2023-012345 (required unless --batch)")
+    parser.add_argument("-f", "--funder", default="vr", help="Funder acronym, or auto to look the grant up for all "
+                                                             "funders. Allowed values: " + ", ".join(funders.acronyms()))
+    parser.add_argument("-l", "--lang", default="eng", help="Language used in DMP, possible values: swe, eng", required=False,)
+    parser.add_argument("-n", "--name", default="", help="Full name of contact person for DMP (required unless --batch)")
+    parser.add_argument("-e", "--email", default="", help="Contact person e-mail (required unless --batch)")
+    parser.add_argument("-o", "--orcid", default="", help="Contact person ORCID (if available)", required=False,)
+    parser.add_argument("-t", "--template", default="", help="DMP Online template ID, or a template title or "
+                                                             "organisation/funder name from the local template index (required unless --batch)")
+    parser.add_argument("-b", "--batch", default="", help="CSV or JSONL file with one grant per row, columns: "
+                                                          + ", ".join(BATCH_FIELDS))
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of grants processed concurrently in batch mode")
+    parser.add_argument("--fetch-workers", type=int, default=0, help="Threads fetching from SweCRIS in batch mode "
+                                                                     "(0: --workers)")
+    parser.add_argument("--build-workers", type=int, default=1, help="Threads building and validating maDMP records "
+                                                                     "in batch mode")
+    parser.add_argument("--upload-workers", type=int, default=0, help="Threads uploading plans to DMPonline in batch "
+                                                                      "mode (0: --workers)")
+    parser.add_argument("--persist-workers", type=int, default=1, help="Threads storing the created plans in batch mode")
+    parser.add_argument("--queue-size", type=int, default=16, help="Grants waiting in front of each stage in batch "
+                                                                   "mode, a full queue holds up the stage before it")
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch fresh data from SweCRIS, bypassing the local cache")
+    parser.add_argument("--force", action="store_true", help="Create plans even for grants already in the upload ledger")
+    parser.add_argument("--validate-only", action="store_true", help="Build and validate the maDMP records without uploading them")
+    parser.add_argument("--no-validate", action="store_true", help="Upload without validating against the maDMP schema")
+    parser.add_argument("--resume", action="store_true", help="Go on with an interrupted batch, skipping the grants "
+                                                             "it already created (see Journals/)")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all prompts")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.validate_only and args.no_validate:
+        parser.error("--validate-only and --no-validate cannot be combined")
+
+    # Load and compile the schema once, before any grant is processed
+    if not args.no_validate:
+        try:
+            madmp_validate.get_validator()
+        except madmp_validate.SchemaError as e:
+            print(str(e) + ". Use --no-validate to upload anyway. Exiting.")
+            exit()
+
+    if args.batch:
+        run_batch(args)
+    else:
+        missing = [opt for opt, value in (("-i/--grantid", args.grantid), ("-n/--name", args.name),
+                                          ("-e/--email", args.email), ("-t/--template", args.template)) if not value]
+        if missing:
+            parser.error("the following arguments are required: " + ", ".join(missing))
+        run_single(args)
+    exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+# Local index of the DMPonline templates, built from the harvest in dmponline_templates.py.
+# Lets -t/--template in swecris_to_dmponline.py take a template title or the name of
+# the organisation/funder owning it instead of a numeric id, without asking DMPonline.
+# The index file holds the template records plus lookup tables from normalised
+# title/organisation/funder names to template ids, so resolving a name is a dict lookup.
+
+INDEX_FILE = os.path.join("Templates", "template_index.json")
+
+
+def normalise(name):
+    return " ".join(str(name).lower().split())
+
+
+def record_of(item):
+    # Template record from a templates API item ({"dmp_template": {...}} or the template itself)
+    template = item.get("dmp_template", item)
+    template_id = template.get("template_id") or {}
+    if isinstance(template_id, dict):
+        template_id = template_id.get("identifier")
+    affiliation = template.get("affiliation") or template.get("org") or {}
+    funder = template.get("funder") or {}
+    return {
+        "id": str(template_id),
+        "title": template.get("title", ""),
+        "org": affiliation.get("name", "") if isinstance(affiliation, dict) else str(affiliation),
+        "funder": funder.get("name", "") if isinstance(funder, dict) else str(funder),
+        "version": template.get("version"),
+        "published": template.get("published", True),
+        "modified": template.get("modified"),
+    }
+
+
+def load_index(path=INDEX_FILE):
+    try:
+        with open(path, encoding="utf-8") as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {"updated": None, "templates": {}, "names": {}}
+
+
+def _build_names(templates):
+    names = {}
+    for record in templates.values():
+        for name in {record["title"], record["org"], record["funder"]}:
+            if name:
+                names.setdefault(normalise(name), []).append(record["id"])
+    return names
+
+
+def update_index(items, complete=True, path=INDEX_FILE):
+    # Merges harvested template items into the index. With complete=True (a full harvest)
+    # templates no longer in DMPonline are dropped. Returns (added, changed, removed).
+    index = load_index(path)
+    templates = index.get("templates", {})
+    seen = set()
+    added = changed = 0
+    for item in items:
+        record = record_of(item)
+        if record["id"] in ("", "None"):
+            continue
+        seen.add(record["id"])
+        old = templates.get(record["id"])
+        if old is None:
+            added += 1
+        elif old != record:
+            changed += 1
+        else:
+            continue
+        templates[record["id"]] = record
+    removed = 0
+    if complete:
+        for template_id in [template_id for template_id in templates if template_id not in seen]:
+            del templates[template_id]
+            removed += 1
+
+    if added or changed or removed or not os.path.exists(path):
+        index = {
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "templates": templates,
+            "names": _build_names(templates),
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+    return added, changed, removed
+
+
+def resolve(value, index=None, path=INDEX_FILE):
+    # Template id for a numeric id, template title or organisation/funder name.
+    # Returns (template_id, candidates): template_id is None if the name is unknown
+    # or matches several templates, candidates then lists the matching records.
+    value = str(value).strip()
+    if value.isdigit():
+        return value, []
+    if index is None:
+        index = load_index(path)
+    templates = index.get("templates", {})
+    ids = index.get("names", {}).get(normalise(value), [])
+    candidates = [templates[template_id] for template_id in ids if template_id in templates]
+    published = [record for record in candidates if record.get("published")]
+    if len(published) == 1:
+        return published[0]["id"], candidates
+    if len(candidates) == 1:
+        return candidates[0]["id"], candidates
+    return None, candidates
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import time
+
+import dmp_files
+
+# Ledger of the plans created in DMPonline, in Uploaded_plans/ledger.sqlite.
+# Keyed by SweCRIS id + contact e-mail, it records the dmp_id of the created plan
+# so that re-runs and batch retries can skip grants that already have a plan
+# without asking SweCRIS or DMPonline. DMPonline itself silently blanks a grant_id
+# that already exists instead of refusing the duplicate plan.
+# For dmponline_reconcile.py it also keeps the language of the plan and the hash of the
+# SweCRIS data the plan was last built from (madmp.source_hash()).
+
+LEDGER_FILE = os.path.join("Uploaded_plans", "ledger.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    swecrisid TEXT NOT NULL,
+    email TEXT NOT NULL,
+    dmp_id TEXT NOT NULL,
+    template TEXT,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (swecrisid, email));
+"""
+
+
+def _add_columns(db):
+    # Columns added later, ledgers from before get them here
+    columns = {row[1] for row in db.execute("PRAGMA table_info(plans)")}
+    for column in ("lang", "source_hash", "updated_at"):
+        if column not in columns:
+            try:
+                db.execute("ALTER TABLE plans ADD COLUMN " + column + " TEXT")
+            except sqlite3.OperationalError:
+                pass  # added by another connection in the meantime
+
+
+def _connection(path=LEDGER_FILE):
+    return dmp_files.sqlite_connection(path, SCHEMA, _add_columns)
+
+
+def _email(email):
+    return email.strip().lower()
+
+
+def lookup(swecrisid, email, path=LEDGER_FILE):
+    # dmp_id of the plan already created for this grant and contact, or None
+    row = _connection(path).execute(
+        "SELECT dmp_id FROM plans WHERE swecrisid = ? AND email = ?", (swecrisid, _email(email))
+    ).fetchone()
+    return row[0] if row else None
+
+
+def record(swecrisid, email, dmp_id, template="", lang=None, source_hash=None, path=LEDGER_FILE):
+    db = _connection(path)
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO plans (swecrisid, email, dmp_id, template, created_at, lang, source_hash)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (swecrisid, _email(email), dmp_id, str(template), time.strftime("%Y-%m-%dT%H:%M:%S"), lang, source_hash),
+        )
+
+
+def plans(path=LEDGER_FILE):
+    # All recorded plans as dicts, oldest first
+    db = _connection(path)
+    cursor = db.execute(
+        "SELECT swecrisid, email, dmp_id, template, created_at, lang, source_hash, updated_at"
+        " FROM plans ORDER BY created_at"
+    )
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def set_source_hash(swecrisid, email, source_hash, updated=True, path=LEDGER_FILE):
+    # Records the hash of the SweCRIS data a plan now has, updated=True if the plan was just updated
+    db = _connection(path)
+    with db:
+        if updated:
+            db.execute(
+                "UPDATE plans SET source_hash = ?, updated_at = ? WHERE swecrisid = ? AND email = ?",
+                (source_hash, time.strftime("%Y-%m-%dT%H:%M:%S"), swecrisid, _email(email)),
+            )
+        else:
+            db.execute(
+                "UPDATE plans SET source_hash = ? WHERE swecrisid = ? AND email = ?",
+                (source_hash, swecrisid, _email(email)),
+            )
+
+
+def known_swecrisids(path=LEDGER_FILE):
+    # All SweCRIS ids with a recorded plan, regardless of contact
+    return {row[0] for row in _connection(path).execute("SELECT DISTINCT swecrisid FROM plans")}
+
+
+def dmp_id_of(postdata):
+    # dmp_id of the created plan from the DMPonline response to the plans POST
+    try:
+        return json.loads(postdata)['items'][0]['dmp']['dmp_id']['identifier']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None